@@ -0,0 +1,37 @@
+import os
+
+from streamlit.testing.v1 import AppTest
+
+from toric_optic_metrology_data import file_hash, write_store
+from test_plots import blank_lot_dataset
+
+APP_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'toric_optic_metrology_backend_20240410.py')
+
+
+# function to run the app on a stored dataset with all lots and attributes of its first part selected
+def run_stored_dataset(store_dir, df, monkeypatch):
+    dataset = file_hash(df.to_csv(index=False).encode())
+    write_store(df, str(store_dir), dataset, 'blank_lots.csv')
+    monkeypatch.setenv('TORIC_METROLOGY_STORE', str(store_dir))
+    at = AppTest.from_file(APP_FILE, default_timeout=60).run()
+    at.selectbox[0].set_value(dataset).run()
+    at.selectbox[1].set_value('P1').run()
+    at.multiselect[0].set_value(['All']).run()
+    at.multiselect[1].set_value(['All']).run()
+    next(c for c in at.main.checkbox if c.label == 'Display Plot').check().run()
+    return at
+
+
+def test_plots_with_blank_lot(tmp_path, monkeypatch):
+    at = run_stored_dataset(tmp_path / 'store', blank_lot_dataset(), monkeypatch)
+    assert not at.exception
+    full_lot = next(s for s in at.sidebar.selectbox if s.label == 'Full Resolution Lot:')
+    assert full_lot.options == ['None', '0', '1', '2', '3', '4']
+
+
+def test_app_runs_with_cache_over_budget(tmp_path, monkeypatch):
+    # every loaded object is over a budget of 0 MB, so the cache only ever keeps the last one
+    monkeypatch.setenv('TORIC_METROLOGY_CACHE_MB', '0')
+    at = run_stored_dataset(tmp_path / 'store', blank_lot_dataset(), monkeypatch)
+    assert not at.exception
+    assert at.subheader[1].value == 'P1: d'
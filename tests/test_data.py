@@ -0,0 +1,127 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from toric_optic_metrology_data import (build_index, cell_stats, custom_sort, data_file_path, lot_attributes, merge_cells, normalize,
+                                        scan_csv, select_rows, summary_stats)
+
+
+# function to create a shuffled dataset of several parts, lots and attributes with some missing keys and values
+def mixed_dataset(parts=3, lots=6, serials=4, attributes=5, seed=0):
+    rng = np.random.default_rng(seed)
+    part, lot, serial, attribute = (a.ravel() for a in np.meshgrid(np.arange(parts), np.arange(lots), np.arange(serials),
+                                                                   np.arange(attributes), indexing='ij'))
+    df = pd.DataFrame({
+        'Part_Number': np.array([f'P{i}' for i in range(parts)])[part],
+        'Part_Description': 'd',
+        'Lot_Number': np.array([str(100 + i) if i % 2 else f'L{i}' for i in range(lots)])[lot],
+        'Serial_Number': serial.astype(str),
+        'Attribute_Number': (attribute + 1).astype(str),
+        'Attribute_Description': 'x',
+        'Attribute_Value': rng.normal(10, 2, len(part)).round(6),
+    })
+    df.loc[::17, 'Lot_Number'] = None
+    df.loc[::23, 'Attribute_Number'] = None
+    df.loc[::29, 'Attribute_Value'] = None
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def test_scan_csv_rejects_missing_columns():
+    with pytest.raises(ValueError, match='Missing column'):
+        scan_csv(io.BytesIO(b'localhost\n'))
+
+
+def test_data_file_path_stays_in_data_dir(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 'lots.csv').write_text('')
+    (tmp_path / 'secret.csv').write_text('')
+    (data_dir / 'link.csv').symlink_to(tmp_path / 'secret.csv')
+    assert data_file_path(str(data_dir), 'lots.csv') == str((data_dir / 'lots.csv').resolve())
+    for name in ['../secret.csv', str(tmp_path / 'secret.csv'), 'link.csv', 'missing.csv', '.']:
+        assert data_file_path(str(data_dir), name) is None
+
+
+def test_build_index_cells_align_with_cell_stats():
+    df = normalize(mixed_dataset())
+    index = build_index(df)
+    cells = cell_stats(df)
+    assert len(index['cell_starts']) == len(cells)
+    for i, (part, lot, attribute) in enumerate(cells.index):
+        rows = df.iloc[index['cell_starts'][i]:index['cell_stops'][i]]
+        assert (rows['Part_Number'] == part).all() and (rows['Lot_Number'] == lot).all()
+        assert (rows['Attribute_Number'] == attribute).all()
+        assert rows['Attribute_Value'].count() == cells['count'].iloc[i]
+    # every part is one slice, including its rows with a missing lot or attribute
+    for part, rows in index['part_rows'].items():
+        assert rows.stop - rows.start == (df['Part_Number'] == part).sum()
+
+
+def test_summary_stats_round_to_float32_precision():
+    df = normalize(pd.DataFrame({'Part_Number': 'P1', 'Part_Description': 'd', 'Lot_Number': ['L1', 'L1', 'L2'],
+                                 'Serial_Number': ['S1', 'S2', 'S1'], 'Attribute_Number': 'A', 'Attribute_Description': 'x',
+                                 'Attribute_Value': [1.485242, 1.485243, 12345.678]}))
+    df_summary = summary_stats(cell_stats(df), 'P1')
+    assert df_summary.loc['A', 'Minimum'] == 1.485242
+    assert df_summary.loc['A', 'Maximum'] == 12345.68
+    assert df_summary.loc['A', 'Mean'] == 4116.216
+
+
+# function to compute the summary statistics of the selected rows of a part directly with a groupby
+def groupby_stats(df, part, lots=None, attributes=None):
+    rows = df[df['Part_Number'] == part]
+    if lots is not None:
+        rows = rows[rows['Lot_Number'].isin(lots)]
+    if attributes is not None:
+        rows = rows[rows['Attribute_Number'].isin(attributes)]
+    rows = rows[rows['Lot_Number'].notna() & rows['Attribute_Number'].notna()]
+    values = rows['Attribute_Value'].astype('float64')
+    return values.groupby(rows['Attribute_Number'].astype(str)).agg(['count', 'mean', 'std', 'min', 'max'])
+
+
+def test_merge_cells_matches_cell_stats():
+    df = normalize(mixed_dataset())
+    keys = ['Part_Number', 'Lot_Number', 'Attribute_Number']
+    # aggregate two halves of every cell separately, like the chunks of a streamed CSV
+    first = df['Serial_Number'].isin(['0', '1'])
+    merged = merge_cells(pd.concat([cell_stats(df[first]), cell_stats(df[~first])]), keys).sort_index()
+    cells = cell_stats(df)
+    assert merged.index.equals(cells.index)
+    np.testing.assert_array_equal(merged['count'], cells['count'])
+    for col in ['mean', 'm2', 'min', 'max']:
+        np.testing.assert_allclose(merged[col], cells[col], rtol=1e-9)
+
+
+@pytest.mark.parametrize('lots, attributes', [(None, None), (['L0', '101', '103'], None), (None, ['2', '4']),
+                                              (['L2', '105'], ['1', '3', '5']), (['missing'], None)])
+def test_summary_stats_match_groupby(lots, attributes):
+    df = normalize(mixed_dataset())
+    cells = cell_stats(df)
+    for part in ['P0', 'P2']:
+        expected = groupby_stats(df, part, lots, attributes)
+        df_summary = summary_stats(cells, part, lots, attributes)
+        assert sorted(df_summary.index.astype(str)) == sorted(expected.index)
+        expected = expected.loc[df_summary.index.astype(str)]
+        np.testing.assert_array_equal(df_summary['Count'], expected['count'])
+        for col, expected_col in [('Mean', 'mean'), ('Standard Deviation', 'std'), ('Minimum', 'min'), ('Maximum', 'max')]:
+            np.testing.assert_allclose(df_summary[col], expected[expected_col], rtol=1e-6)
+
+
+@pytest.mark.parametrize('lots, attributes', [(None, None), (['L0', '101', '103'], None), (None, ['2', '4']),
+                                              (['L2', '105'], ['1', '3', '5']), (['missing'], ['missing'])])
+def test_select_rows_matches_mask(lots, attributes):
+    df = normalize(mixed_dataset())
+    index = build_index(df)
+    for part in index['parts']:
+        df_part = df.iloc[index['part_rows'][part]]
+        mask = df_part['Lot_Number'].notna() & df_part['Attribute_Number'].notna()
+        if lots is not None:
+            mask &= df_part['Lot_Number'].isin(lots)
+        if attributes is not None:
+            mask &= df_part['Attribute_Number'].isin(attributes)
+        np.testing.assert_array_equal(select_rows(index, part, lots, attributes), np.flatnonzero(mask))
+        if lots is not None:
+            assert lot_attributes(index, part, lots) == sorted(
+                df_part.loc[df_part['Lot_Number'].isin(lots), 'Attribute_Number'].dropna().astype(str).unique(), key=custom_sort)
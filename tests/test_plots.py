@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from toric_optic_metrology_data import normalize
+from toric_optic_metrology_plots import attribute_groups, batched_figure, downsample_points, downsample_positions
+
+
+# function to create one attribute of a part with a blank Lot_Number on every tenth row
+def blank_lot_dataset(rows=3000):
+    positions = np.arange(rows)
+    return normalize(pd.DataFrame({
+        'Part_Number': 'P1',
+        'Part_Description': 'd',
+        'Lot_Number': np.where(positions % 10 == 0, None, (positions % 5).astype(str)),
+        'Serial_Number': (positions % 7).astype(str),
+        'Attribute_Number': 'A',
+        'Attribute_Description': 'x',
+        'Attribute_Value': np.random.default_rng(0).random(rows),
+    }))
+
+
+def test_downsample_points_keeps_blank_lot():
+    df = blank_lot_dataset()
+    df_plot = downsample_points(df, 500)
+    assert len(df_plot) <= 500
+    assert df_plot['Lot_Number'].isna().any()
+
+
+def test_batched_figure_with_blank_lot():
+    df = blank_lot_dataset()
+    fig = batched_figure(df, attribute_groups(df), ['A'], max_points=500)
+    assert 0 < len(fig.data[0].x) <= 500
+
+
+def test_downsample_points_caps_many_lots():
+    rng = np.random.default_rng(1)
+    for lots, per_lot, max_points in [(10000, 20, 5000), (3000, 2, 5000), (100, 200, 500), (7, 1000, 5)]:
+        positions = np.arange(lots * per_lot)
+        lot_codes = rng.permutation(positions % lots)
+        values = rng.standard_normal(len(positions)) ** 3
+        kept = downsample_positions(lot_codes, values, max_points)
+        assert len(kept) <= max_points
+        assert len(np.unique(kept)) == len(kept)
+        # every lot keeps its minimum and maximum when the budget has room for them
+        if 2 * lots <= max_points // 2:
+            groups = pd.Series(values).groupby(lot_codes)
+            assert set(groups.idxmin()) <= set(kept) and set(groups.idxmax()) <= set(kept)
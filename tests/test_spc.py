@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from toric_optic_metrology_data import (KEY_COLUMNS, append_rows, build_index, cell_stats, deduplicate, extend_cells, normalize,
+                                        read_store, store_version, write_store)
+from toric_optic_metrology_spc import SERIES_KEYS, WE_RULES, build_spc, extend_spc
+
+
+# function to create two parts of drifting lots, so the appended lots move the limits and trigger rule violations
+def drifting_dataset(lots=30, serials=5, seed=0):
+    rng = np.random.default_rng(seed)
+    part, lot, serial, attribute = (a.ravel() for a in np.meshgrid(np.arange(2), np.arange(lots), np.arange(serials),
+                                                                   np.arange(3), indexing='ij'))
+    return normalize(pd.DataFrame({
+        'Part_Number': 'P' + part.astype(str),
+        'Part_Description': 'd',
+        'Lot_Number': np.char.add('L', np.char.zfill(lot.astype(str), 3)),
+        'Serial_Number': 'S' + serial.astype(str),
+        'Attribute_Number': 'A' + attribute.astype(str),
+        'Attribute_Description': 'x',
+        'Attribute_Value': 10 + 0.05 * lot * (attribute == 1) + rng.standard_normal(len(lot)),
+    }))
+
+
+def test_extend_spc_matches_rebuild():
+    df = drifting_dataset()
+    appended = df['Lot_Number'].isin(['L025', 'L026', 'L027', 'L028', 'L029']) & (df['Part_Number'] == 'P0')
+    cells = cell_stats(df[~appended])
+    new_cells = cell_stats(df[appended])
+    all_cells = extend_cells(cells, new_cells)
+
+    state, limits, points = extend_spc(build_spc(cells), all_cells, new_cells)
+    _, rebuilt_limits, rebuilt_points = build_spc(all_cells)
+
+    rebuilt_limits = rebuilt_limits.reindex(limits.index)
+    for col in ['Lots', 'CL', 'UCL', 'LCL', 'Sigma']:
+        np.testing.assert_allclose(limits[col], rebuilt_limits[col])
+    assert limits['Violations'].sum() > 0
+    assert (limits['Violations'] == rebuilt_limits['Violations']).all()
+
+    rules = [name for name, _, _, _ in WE_RULES]
+    flags = points.set_index(SERIES_KEYS + ['Lot_Number'])[rules].sort_index()
+    rebuilt_flags = rebuilt_points.set_index(SERIES_KEYS + ['Lot_Number'])[rules].sort_index()
+    pd.testing.assert_frame_equal(flags, rebuilt_flags)
+
+
+def test_append_rows_matches_rebuild(tmp_path):
+    df = drifting_dataset()
+    new_lots = df['Lot_Number'].isin(['L025', 'L026', 'L027', 'L028', 'L029']) & (df['Part_Number'] == 'P0')
+    base = normalize(df[~new_lots].reset_index(drop=True))
+    # the new rows repeat some existing rows and one of their own rows, which are skipped
+    new_rows = pd.concat([df[new_lots], df[~new_lots].iloc[:7], df[new_lots].iloc[:1]]).astype(str)
+    path = write_store(base, str(tmp_path), 'base', 'base.csv')
+
+    extended, index, cells, new_cells, added, skipped, version = append_rows(path, base, build_index(base), cell_stats(base),
+                                                                             new_rows)
+    assert (added, skipped) == (new_lots.sum(), 8)
+    assert version == store_version(path)
+
+    # the dataset, index and aggregates match the ones rebuilt from the stored dataset
+    rebuilt = read_store(path)
+    pd.testing.assert_frame_equal(extended, rebuilt)
+    rebuilt_index = build_index(rebuilt)
+    for key in ['parts', 'part_rows', 'part_cells', 'lots', 'attributes']:
+        assert index[key] == rebuilt_index[key]
+    for key in ['cell_starts', 'cell_stops', 'cell_lots', 'cell_attributes']:
+        np.testing.assert_array_equal(index[key], rebuilt_index[key])
+    rebuilt_cells = cell_stats(rebuilt)
+    np.testing.assert_array_equal(cells.index.to_frame().astype(str), rebuilt_cells.index.to_frame().astype(str))
+    for col in cells.columns:
+        np.testing.assert_allclose(cells[col], rebuilt_cells[col], rtol=1e-9)
+    np.testing.assert_array_equal(new_cells['count'].sum(), new_lots.sum())
+
+
+def test_deduplicate_matches_rebuild():
+    df = drifting_dataset()
+    # rows of the first and last cell with some serials renamed, so they repeat existing keys and each other
+    new_rows = pd.concat([df.iloc[:5], df.iloc[-3:]]).astype(str)
+    new_rows['Serial_Number'] = ['S0', 'S1', 'S0', 'S9', 'S9', 'S0', 'S8', 'S8']
+    new_rows['Attribute_Value'] = [str(i) for i in range(8)]
+    kept = deduplicate(df, build_index(df), normalize(new_rows))
+
+    # rebuild: keep the last of the repeated new keys and drop the keys of the whole dataset
+    expected = new_rows.drop_duplicates(KEY_COLUMNS, keep='last')
+    existing = pd.MultiIndex.from_frame(df[KEY_COLUMNS].astype(str))
+    expected = expected[~pd.MultiIndex.from_frame(expected[KEY_COLUMNS]).isin(existing)]
+    assert sorted(kept['Attribute_Value'].astype(str)) == sorted(expected['Attribute_Value'].astype(float).astype(str))
+    assert len(kept) == 2
@@ -1,72 +1,451 @@
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-
-# function to sort alpha first then numeric values
-@st.cache_data
-def custom_sort(item):
-    if item.isdigit():
-        return (float('inf'), int(item))
-    else:
-        return (0, item)
+
+from toric_optic_metrology_data import (append_rows, build_index, cell_stats, custom_sort, data_file_path, derive_attributes, file_hash,
+                                        list_store, load_rules, lot_attributes, memory_size, read_csv_part, read_files,
+                                        read_store, scan_csv, select_rows, sheet_names, store_path, store_version, summary_stats,
+                                        write_store)
+from toric_optic_metrology_plots import (MAX_POINTS, attribute_figure, attribute_groups, batched_figure, downsample_points,
+                                         spc_figure, std_figure)
+from toric_optic_metrology_profile import profile_table, stage, start_profile, write_profile_log
+from toric_optic_metrology_spc import SERIES_KEYS, WE_RULES, build_spc, extend_spc, load_spec_limits, part_limits
+
+# memory budget in MB of the datasets, indexes and aggregates cached by the loaders, shared by every loader and session;
+# the least recently used entries are evicted once their memory usage adds up to more than the budget
+MAX_CACHE_MB = int(os.environ.get('TORIC_METROLOGY_CACHE_MB', 2048))
+
+# directory of the columnar store for converted uploads
+STORE_DIR = os.environ.get('TORIC_METROLOGY_STORE', 'metrology_store')
+
+# directory of the CSV files that can be streamed from the server, the server path input is hidden when it is unset
+DATA_DIR = os.environ.get('TORIC_METROLOGY_DATA_DIR')
+
+# config file of the derived attribute rules
+RULES_FILE = os.environ.get('TORIC_METROLOGY_RULES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'derived_attributes.json'))
+
+# spec limits CSV (Part_Number, Attribute_Number, LSL, USL) used for the process capability
+SPEC_LIMITS_FILE = os.environ.get('TORIC_METROLOGY_SPECS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spec_limits.csv'))
+
+# optional JSON lines log the stage timings of every profiled rerun are appended to
+PROFILE_LOG = os.environ.get('TORIC_METROLOGY_PROFILE_LOG')
+
+# number of attributes above which plots default to batched figures, and attributes per batched page
+BATCH_THRESHOLD = 20
+BATCH_PAGE_SIZE = 12
+
+# function to get the cache of the loaders below, shared across reruns and sessions: the cached objects with their memory
+# usage in least recently used order, the keys being loaded with a lock each, and a lock serializing appends to the store
+# NOTE: cached objects are shared, so they must be treated as read-only
+@st.cache_resource
+def dataset_cache():
+    return {'lock': threading.Lock(), 'entries': OrderedDict(), 'bytes': 0, 'loading': {}, 'append_lock': threading.Lock()}
+
+# function to add an object to the cache, evicting the least recently used objects while the cache is over its budget
+# NOTE: a derived dataset shares the columns of the dataset it was derived from but both are counted in full,
+# so the memory held stays below the budget
+def put_cached(key, value):
+    cache = dataset_cache()
+    size = memory_size(value)
+    with cache['lock']:
+        if key in cache['entries']:
+            cache['bytes'] -= cache['entries'].pop(key)[1]
+        cache['entries'][key] = (value, size)
+        cache['bytes'] += size
+        # keep the object just added even if it is over the budget on its own
+        while cache['bytes'] > MAX_CACHE_MB * 2 ** 20 and len(cache['entries']) > 1:
+            cache['bytes'] -= cache['entries'].popitem(last=False)[1][1]
+
+# function to get an object from the cache, loading it once on a miss even when several sessions ask for it at once
+def cached(key, load, spinner=None):
+    cache = dataset_cache()
+    with cache['lock']:
+        if key in cache['entries']:
+            cache['entries'].move_to_end(key)
+            return cache['entries'][key][0]
+        key_lock = cache['loading'].setdefault(key, threading.Lock())
+    with key_lock:
+        with cache['lock']:
+            if key in cache['entries']:
+                cache['entries'].move_to_end(key)
+                return cache['entries'][key][0]
+        try:
+            if spinner is None:
+                value = load()
+            else:
+                with st.spinner(spinner):
+                    value = load()
+            put_cached(key, value)
+        finally:
+            with cache['lock']:
+                cache['loading'].pop(key, None)
+    return value
+
+# function to parse the selected sheets of the uploaded files in a process pool once per unique content and sheet
+# selection, returning the dataset and warnings about skipped sheets and values
+def load_file(content_hash, files, sheets):
+    return cached(('file', content_hash), lambda: read_files(files, sheets), 'Parsing uploaded files...')
+
+# function to list the sheets of an uploaded workbook once per unique content
+def load_sheet_names(content_hash, file_name, file_bytes):
+    return cached(('sheets', content_hash), lambda: sheet_names(file_name, file_bytes))
+
+# function to open a dataset from the columnar store once per version
+def load_stored(dataset_key, path):
+    return cached(('stored', dataset_key), lambda: read_store(path), 'Opening stored dataset...')
+
+# function to get the key of a stored dataset, which changes with every append so no loader returns the rows before it
+def stored_dataset_key(path):
+    return f'{os.path.basename(path)}/{store_version(path)}'
+
+# function to evaluate the derived attribute rules once per dataset and rule table
+def load_derived(dataset_key, rules, df):
+    return cached(('derived', dataset_key, json.dumps(rules, sort_keys=True)), lambda: derive_attributes(df, rules),
+                  'Deriving attributes...')
+
+# function to build the Part/Lot/Attribute index once per dataset
+def load_index(dataset_key, df):
+    return cached(('index', dataset_key), lambda: build_index(df), 'Indexing dataset...')
+
+# function to compute the per-(part, lot, attribute) aggregates once per dataset
+def load_cell_stats(dataset_key, df):
+    return cached(('cells', dataset_key), lambda: cell_stats(df), 'Computing summary statistics...')
+
+# function to scan a CSV in chunks for its part list and aggregates, without keeping its rows
+def scan_csv_progress(source):
+    progress_bar = st.progress(0.0, text='Scanning CSV...')
+    scan = scan_csv(source, progress=lambda fraction: progress_bar.progress(fraction, text='Scanning CSV...'))
+    progress_bar.empty()
+    return scan
+
+# function to scan a CSV once per dataset
+def load_csv_scan(dataset_key, source):
+    return cached(('csv_scan', dataset_key), lambda: scan_csv_progress(source))
+
+# function to read the rows of one Part_Number from a CSV in chunks
+def read_csv_part_progress(source, part_number):
+    progress_bar = st.progress(0.0, text=f'Reading {part_number} from CSV...')
+    df = read_csv_part(source, part_number, progress=lambda fraction: progress_bar.progress(fraction, text=f'Reading {part_number} from CSV...'))
+    progress_bar.empty()
+    return df
+
+# function to read the rows of one Part_Number from a CSV once per dataset and part
+def load_csv_part(dataset_key, part_number, source):
+    return cached(('csv_part', dataset_key, part_number), lambda: read_csv_part_progress(source, part_number))
+
+# function to get the key of the spec limits table, so the SPC is recomputed when the spec limits change
+def specs_key(specs):
+    return specs.to_json()
+
+# function to build the control limits, capability and rule violations of every attribute series
+def build_spc_points(cells, specs):
+    state, limits, points = build_spc(cells, specs)
+    # index the points by series so one control chart is a lookup
+    return state, limits, points.set_index(SERIES_KEYS).sort_index()
+
+# function to build the SPC once per dataset and spec limits
+def load_spc(dataset_key, specs, cells):
+    return cached(('spc', dataset_key, specs_key(specs)), lambda: build_spc_points(cells, specs), 'Computing control limits...')
+
+# function to display the statistical process control of the selected attributes of a part (None selects all)
+def display_spc(spc, part_number, attributes):
+    # create checkbox to display statistical process control
+    show_spc = st.checkbox('Display Statistical Process Control')
+
+    # if checkbox is selected, display the control limits and the control chart of an attribute number
+    if show_spc:
+        st.subheader('Statistical Process Control')
+        st.markdown('**Control Limits, Capability and Western Electric Rule Violations across All Lot Numbers**')
+        _, limits, points = spc
+        df_limits = part_limits(limits, part_number)
+        if attributes is not None:
+            df_limits = df_limits[df_limits.index.isin(attributes)]
+        df_limits = df_limits.loc[sorted(df_limits.index, key=custom_sort)]
+        # display control limits dataframe
+        st.dataframe(df_limits, width=2000)
+
+        # have a selectbox to select the Attribute_Number of the control chart
+        spc_attribute = st.selectbox('Control Chart Attribute Number:', list(df_limits.index))
+        if spc_attribute is not None:
+            with stage(profile, 'control_chart') as record:
+                series = points.loc[[(part_number, spc_attribute)]].sort_values('seq')
+                record['rows'] = len(series)
+                # create Plotly control chart
+                fig = spc_figure(series, df_limits.loc[spc_attribute], spc_attribute, [name for name, _, _, _ in WE_RULES])
+                # display Plotly plot using Streamlit
+                st.plotly_chart(fig)
+
+# function to display the summary statistics of the selected lots and attributes of a part (None selects all)
+def display_summary_statistics(cells, part_number, lots, attributes, std_title):
+    # create checkbox to display summary statistics
+    summary = st.checkbox('Display Summary Statistics')
+
+    # if checkbox is selected, display summary statistics for the selected lots and attributes
+    if summary:
+        st.subheader('Summary Statistics')
+        st.markdown('**Summary Statistics for All Lot Numbers**')
+        # merge the per-lot aggregates of the selected cells into one row per attribute_number
+        with stage(profile, 'summary_stats', len(cells)):
+            df_summary = summary_stats(cells, part_number, lots, attributes)
+        # display summary statistics dataframe
+        st.dataframe(df_summary, width=2000)
+
+        # create checkbox to plot the std of each attribute number
+        plot_std = st.checkbox('Plot Standard Deviation')
+
+        # if checkbox is selected, display scatter plot for the std of each attribute number
+        if plot_std:
+            with stage(profile, 'std_figure', len(df_summary)):
+                # create Plotly scatter plot
+                fig = std_figure(df_summary, std_title)
+                # display Plotly plot using Streamlit
+                st.plotly_chart(fig)
+
+# function to display the Lot_Number x Attribute_Value plots of the selected attributes (None plots all attributes)
+def display_plots(df_filtered, attributes):
+    # create checkbox to display plot
+    plot = st.checkbox('Display Plot')
+
+    # if checkbox is selected, display the plots of the selected attributes
+    if plot:
+        # find the rows of every Attribute_Number in one pass instead of re-masking the dataframe per attribute
+        groups = attribute_groups(df_filtered)
+        if attributes is None:
+            attributes = sorted(groups, key=custom_sort)
+        attributes = [i for i in attributes if i in groups]
+
+        # have a sidebar to set the point budget per plot (0 shows every point) and a lot to show at full resolution
+        max_points = st.sidebar.number_input('Max Points per Plot:', min_value=0, value=MAX_POINTS, step=1000) or None
+        # a missing Lot_Number can't be sorted by custom_sort, so only named lots can be shown at full resolution
+        full_lot = st.sidebar.selectbox('Full Resolution Lot:', ['None'] + sorted(df_filtered['Lot_Number'].dropna().unique(), key=custom_sort))
+        full_lot = None if full_lot == 'None' else full_lot
+
+        # have a radio to select between one figure per attribute and paginated batched figures
+        plot_mode = st.radio('Plot Mode:', ['Individual', 'Batched'], index=int(len(attributes) > BATCH_THRESHOLD), horizontal=True)
+
+        if plot_mode == 'Batched':
+            # only the figure of the selected page is built and sent to the browser
+            pages = max(1, math.ceil(len(attributes) / BATCH_PAGE_SIZE))
+            page = st.number_input(f'Page (of {pages}):', min_value=1, max_value=pages, value=1) if pages > 1 else 1
+            page_attributes = attributes[(page - 1) * BATCH_PAGE_SIZE:page * BATCH_PAGE_SIZE]
+            with stage(profile, 'batched_figure', sum(len(groups[i]) for i in page_attributes)):
+                # create one WebGL figure for the attributes of the page
+                fig = batched_figure(df_filtered, groups, page_attributes, max_points=max_points, full_lot=full_lot)
+                # display Plotly plot using Streamlit
+                st.plotly_chart(fig)
+        else:
+            with stage(profile, f'attribute_figures ({len(attributes)})', sum(len(groups[i]) for i in attributes)):
+                # iterate through the selected Attribute_Number and display Plotly plot for each Attribute_Number
+                for i in attributes:
+                    # keep the extremes and outliers of every lot within the point budget
+                    df_plot = downsample_points(df_filtered.iloc[groups[i]], max_points, full_lot)
+                    # create Plotly scatter plot
+                    fig = attribute_figure(df_plot, i)
+                    # display Plotly plot using Streamlit
+                    st.plotly_chart(fig)
 
 # display title
 st.title('Toric Optic Metrology')
 
-# file upload
-uploaded_file = st.file_uploader("Upload Excel or CSV file", type=["xlsx", "csv"])
-
-# check if file is uploaded
-if uploaded_file is not None:
-    # read the uploaded file
-    if uploaded_file.name.endswith('.xlsx'):
-        df = pd.read_excel(uploaded_file, sheet_name='Sheet1')
-    elif uploaded_file.name.endswith('.csv'):
-        df = pd.read_csv(uploaded_file)
+# have a sidebar checkbox to record the wall time and rows of every stage of a rerun, and one to also trace peak memory
+# (tracing slows down every allocation, so the timings of a traced rerun are inflated)
+debug = st.sidebar.checkbox('Debug Instrumentation')
+profile = start_profile(debug, debug and st.sidebar.checkbox('Trace Memory'))
+
+# file upload, one or more Excel and CSV files that are loaded together as one dataset
+uploaded_files = st.file_uploader("Upload Excel or CSV file(s)", type=["xlsx", "csv"], accept_multiple_files=True)
+# a single uploaded file can also be streamed
+uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
+
+# have a sidebar to open a dataset that was converted to the columnar store in an earlier session
+stored_datasets = list_store(STORE_DIR)
+stored_dataset = st.sidebar.selectbox('Stored Dataset:', ['None'] + list(stored_datasets), format_func=lambda x: stored_datasets.get(x, x))
+
+# have a sidebar checkbox to stream CSV files in chunks instead of loading them whole, optionally from the data directory
+streaming_csv = st.sidebar.checkbox('Streaming CSV Mode')
+csv_path = st.sidebar.text_input('Server CSV Path:', help=f'Relative to {DATA_DIR}') if streaming_csv and DATA_DIR else ''
+
+df = None
+csv_scan = None
+csv_source = None
+store_dataset = None
+dataset_key = None
+part_number = None
+
+# hash the uploaded bytes once per upload so reruns don't rehash the whole files
+if uploaded_files:
+    upload_hashes = st.session_state.get('upload_hashes', {})
+    upload_hashes = {f.file_id: upload_hashes.get(f.file_id) or file_hash(f.getvalue()) for f in uploaded_files}
+    st.session_state['upload_hashes'] = upload_hashes
+    file_hashes = [upload_hashes[f.file_id] for f in uploaded_files]
+
+    # have a sidebar to multiselect the sheets of the uploaded workbooks, all sheets with the dataset columns when none are
+    sheet_options = [(f.name, sheet) for f, content_hash in zip(uploaded_files, file_hashes) if f.name.endswith('.xlsx')
+                     for sheet in load_sheet_names(content_hash, f.name, f.getvalue())]
+    selected_sheets = []
+    if len(sheet_options) > 1:
+        selected_sheets = st.sidebar.multiselect('Excel Sheets:', sheet_options, format_func=lambda x: f'{x[0]}: {x[1]}',
+                                                 placeholder='All sheets')
+    upload_sheets = {}
+    for file_name, sheet in selected_sheets:
+        upload_sheets.setdefault(file_name, []).append(sheet)
+
+    # a single CSV keeps the hash of its content, several files or sheets are keyed by all of their hashes and the selection
+    if len(uploaded_files) == 1 and uploaded_file.name.endswith('.csv'):
+        upload_hash = file_hashes[0]
+    else:
+        upload_hash = file_hash('\n'.join(file_hashes + [f'{file_name}: {sheet}' for file_name, sheet in selected_sheets]).encode())
+    dataset_key = upload_hash
+
+# check if a CSV is streamed from the server path or the upload
+if streaming_csv and csv_path:
+    # files outside the data directory are reported like missing ones, so the input doesn't reveal what exists
+    csv_source = data_file_path(DATA_DIR, csv_path)
+    if csv_source is not None:
+        dataset_key = f'{csv_source}:{os.path.getmtime(csv_source)}:{os.path.getsize(csv_source)}'
     else:
-        st.error("Invalid file format. Please upload an Excel or CSV file.")
+        st.error(f'CSV file not found in the data directory: {csv_path}')
+elif streaming_csv and uploaded_file is not None and uploaded_file.name.endswith('.csv'):
+    csv_source = uploaded_file
+
+# check if files are uploaded
+elif uploaded_files:
+    # read the uploaded files (parsed only on the first load of this content)
+    if all(f.name.endswith(('.xlsx', '.csv')) for f in uploaded_files):
+        # open the columnar copy instead of parsing again if this content was converted before
+        if upload_hash in stored_datasets:
+            store_dataset = store_path(STORE_DIR, upload_hash)
+            dataset_key = stored_dataset_key(store_dataset)
+            with stage(profile, 'load_stored') as record:
+                df = load_stored(dataset_key, store_dataset)
+                record['rows'] = len(df)
+        else:
+            try:
+                with stage(profile, 'parse_upload') as record:
+                    df, load_warnings = load_file(upload_hash, [(f.name, f.getvalue()) for f in uploaded_files], upload_sheets)
+                    record['rows'] = len(df)
+            except ValueError as e:
+                st.error(f'Could not read the uploaded files: {e}')
+            else:
+                for warning in load_warnings:
+                    st.sidebar.warning(warning)
+
+                # have a sidebar checkbox to convert the upload once into the columnar store
+                if st.sidebar.checkbox('Save to Columnar Store'):
+                    with st.spinner('Converting to columnar store...'), stage(profile, 'write_store', len(df)):
+                        store_dataset = write_store(df, STORE_DIR, upload_hash, ', '.join(f.name for f in uploaded_files))
+                        dataset_key = stored_dataset_key(store_dataset)
+                        df = load_stored(dataset_key, store_dataset)
+    else:
+        st.error("Invalid file format. Please upload Excel or CSV files.")
+
+# check if a stored dataset is selected
+elif stored_dataset != 'None':
+    store_dataset = store_path(STORE_DIR, stored_dataset)
+    dataset_key = stored_dataset_key(store_dataset)
+    with stage(profile, 'load_stored') as record:
+        df = load_stored(dataset_key, store_dataset)
+        record['rows'] = len(df)
 # else:
 #     # read the default file
 #     file = 'Toric_Optic_Metrology_Backend.xlsx'
 #     df = pd.read_excel(file, sheet_name='Sheet1')
 
+# scan the streamed CSV in chunks (only on the first load of this file)
+if csv_source is not None:
+    try:
+        with stage(profile, 'csv_scan') as record:
+            csv_scan = load_csv_scan(dataset_key, csv_source)
+            record['rows'] = int(csv_scan['cells']['count'].sum())
+    except ValueError as e:
+        st.error(f'Could not read the CSV file: {e}')
+
+# read the derived attribute rule table and the spec limits
+rules = load_rules(RULES_FILE)
+specs = load_spec_limits(SPEC_LIMITS_FILE)
+
+if df is not None or csv_scan is not None:
+    if csv_scan is not None:
+        # in streaming mode the part list and aggregates come from the chunked scan
+        index = csv_scan
+        cells = csv_scan['cells']
+        with stage(profile, 'spc', len(cells)):
+            spc = load_spc(dataset_key, specs, cells)
+    else:
+        # add the derived attribute columns of the rule table
+        with stage(profile, 'derive_attributes', len(df)):
+            df = load_derived(dataset_key, rules, df)
+        # index the dataset once so the option lists and filters below only touch the selected rows
+        with stage(profile, 'build_index', len(df)):
+            index = load_index(dataset_key, df)
+        with stage(profile, 'cell_stats', len(df)):
+            cells = load_cell_stats(dataset_key, df)
+        with stage(profile, 'spc', len(cells)):
+            spc = load_spc(dataset_key, specs, cells)
+
+    # have a sidebar file upload to append the rows of new lots to a stored dataset
+    if store_dataset is not None:
+        new_lot_file = st.sidebar.file_uploader('Append New Lot Data', type=['xlsx', 'csv'])
+
+        # append each new lot file once, updating the stored dataset, its index, aggregates and SPC with the new rows only
+        if new_lot_file is not None and st.session_state.get('append_file_id') != new_lot_file.file_id:
+            try:
+                with st.spinner('Appending new lot data...'), stage(profile, 'append_rows') as record, dataset_cache()['append_lock']:
+                    # another session appended since this rerun loaded the dataset, so rerun on the current version first
+                    if stored_dataset_key(store_dataset) != dataset_key:
+                        st.rerun()
+                    st.session_state['append_file_id'] = new_lot_file.file_id
+                    # read every sheet of the new lot file with the dataset columns, like an upload
+                    new_rows, append_warnings = read_files([(new_lot_file.name, new_lot_file.getvalue())])
+                    record['rows'] = len(new_rows)
+                    df, index, cells, new_cells, added, skipped, version = append_rows(store_dataset, df, index, cells, new_rows, rules)
+                    if new_cells is not None:
+                        state, limits, points = extend_spc((spc[0], spc[1], spc[2].reset_index()), cells, new_cells, specs)
+                        spc = (state, limits, points.set_index(SERIES_KEYS).sort_index())
+                        # cache the extended dataset under its new version, so no loader reads or recomputes it
+                        dataset_key = f'{os.path.basename(store_dataset)}/{version}'
+                        put_cached(('stored', dataset_key), df)
+                        put_cached(('index', dataset_key), index)
+                        put_cached(('cells', dataset_key), cells)
+                        put_cached(('spc', dataset_key, specs_key(specs)), spc)
+            except ValueError as e:
+                st.sidebar.error(f'Could not append {new_lot_file.name}: {e}')
+            else:
+                for warning in append_warnings:
+                    st.sidebar.warning(warning)
+                st.sidebar.success(f'Appended {added} row(s) from {new_lot_file.name}, skipped {skipped} duplicate row(s)')
+
     # display dataframe that shows the Part_Number and its corresponding Part_Description
     st.subheader('Part Number and Part Description')
-    st.dataframe(df[['Part_Number', 'Part_Description']].drop_duplicates().sort_values('Part_Number'), width=2000)
-
-    # create empty list to store Part_Number
-    part_number = []
-
-    # loop through dataframe and append unique Part_Number to list
-    for i in df['Part_Number'].unique():
-        part_number.append(i)
+    st.dataframe(index['part_descriptions'], width=2000)
 
     # have a sidebar to select the Part_Number
-    part_number = st.sidebar.selectbox('Part Number:', ['Select Part Number'] + sorted(part_number, key=custom_sort))
+    part_number = st.sidebar.selectbox('Part Number:', ['Select Part Number'] + index['parts'])
 
     # check if Part_Number is selected
     if part_number != 'Select Part Number':             # NOTE - selection of Part_Number ###############################################################################################
         # display subheader
+        # in streaming mode read only the rows of the selected Part_Number and index them
+        if csv_scan is not None:
+            with stage(profile, 'csv_part') as record:
+                df = load_derived(f'{dataset_key}/{part_number}', rules, load_csv_part(dataset_key, part_number, csv_source))
+                index = load_index(f'{dataset_key}/{part_number}', df)
+                record['rows'] = len(df)
+
         # filter dataframe based on Part_Number
-        df_filtered = df[df['Part_Number'] == part_number]
-        part_description = df_filtered['Part_Description'].unique()[0]
+        df_part = df.iloc[index['part_rows'][part_number]]
+        part_description = df_part['Part_Description'].iloc[0]
         st.subheader(f'{part_number}: {part_description}')
 
-        # FIXME - add new attribute 'cylinder_diopter_stability' based on the following conditions
-        # if Part_Number selected includes PRD11340, PRD11504, PRD11566, PRD11601, PRD11602, PRD11505, PRD11506, PRD11582, PRD11583 then include a new attribte called 'cylinder_diopter_stability'
-        if part_number in ['PRD11340', 'PRD11504', 'PRD11566', 'PRD11601', 'PRD11602', 'PRD11505', 'PRD11506', 'PRD11582', 'PRD11583']:
-            # create a new column 'cylinder_diopter_stability' based on the following conditions
-            df_filtered['cylinder_diopter_stability'] = df_filtered['Attribute_Value'].apply(lambda x: 'Stable' if x <= 0.5 else 'Unstable')
-
-        # create empty list to store Lot_Number
-        lot_number = []
-
-        # loop through filtered dataframe and append unique Lot_Number to list
-        for i in df_filtered['Lot_Number'].unique():
-            lot_number.append(i)
+        # NOTE - derived attributes such as 'cylinder_diopter_stability' are already columns of the dataset, see RULES_FILE
+        df_filtered = df_part
 
-        # add an option to select all lot numbers
-        lot_number.append('All')
+        # get the precomputed Lot_Number list and add an option to select all lot numbers
+        lot_number = index['lots'][part_number] + ['All']
 
         # have a sidebar to multiselect the Lot_Number
         lot_number = st.sidebar.multiselect('Lot Number:', sorted(lot_number, key=custom_sort))
@@ -74,14 +453,8 @@ if uploaded_file is not None:
         if 'All' in lot_number:                         # NOTE - selection of Lot_Number ###############################################################################################    
             st.markdown('All Lot Numbers are Selected')
 
-            # create empty list to store attribute numbers
-            attribute_number = []
-            # loop through filtered dataframe and append unique Attribute_Number to list
-            for i in df_filtered['Attribute_Number'].unique():
-                attribute_number.append(i)
-
-            # add an option to select all attribute numbers
-            attribute_number.append('All')
+            # get the precomputed Attribute_Number list and add an option to select all attribute numbers
+            attribute_number = index['attributes'][part_number] + ['All']
 
             # display a dataframe that shows the Attribute_Number and its corresponding Attribute_Description
             st.subheader('Attribute Number and Attribute Description')
@@ -96,62 +469,14 @@ if uploaded_file is not None:
                 # NOTE: display filtered dataframe
                 # st.dataframe(df_filtered, width=2000)
 
-                # create checkbox to display summary statistics
-                summary = st.checkbox('Display Summary Statistics')
-
-                # if checkbox is selected, display summary statistics for the filtered dataframe
-                if summary:
-                    st.subheader('Summary Statistics')
-                    st.markdown('**Summary Statistics for All Lot Numbers**')
-                    # create a dataframe to display summary statistics for attribute_number
-                    df_summary = df_filtered.groupby(['Attribute_Number']).agg({'Attribute_Value': ['count', 'mean', 'std', 'min', 'max']})
-                    # rename columns
-                    df_summary.columns = ['Count', 'Mean', 'Standard Deviation', 'Minimum', 'Maximum']
-                    # sort df_summary by Attribute_Number
-                    df_summary = df_summary.sort_index()
-                    # display summary statistics dataframe
-                    st.dataframe(df_summary, width=2000)
-
-                    # create checkbox to plot the std of each attribute number
-                    plot_std = st.checkbox('Plot Standard Deviation')
-
-                    # if checkbox is selected, display scatter plot for the std of each attribute number
-                    if plot_std:
-                        # create Plotly scatter plot
-                        fig = px.scatter(df_summary, x=df_summary.index, y='Standard Deviation', title='Standard Deviation for All Attribute Numbers in All of Lot Numbers')
-                        fig.update_layout(xaxis_tickangle=-90)
-                        fig.update_xaxes(type='category', dtick=1)
-                        fig.update_traces(mode='lines+markers', line=dict(color='blue'), marker=dict(color='blue'))
-                        # display Plotly plot using Streamlit
-                        st.plotly_chart(fig)
-
-                # create checkbox to display plot
-                plot = st.checkbox('Display Plot')
-
-                # if checkbox is selected and attribute_number is not empty, iterate through all the selected Attribute_Number and display Plotly plot for each Attribute_Number
-                if plot and 'All' in attribute_number:          # NOTE - selection of Plot ###############################################################################################
-                    for i in df_filtered['Attribute_Number'].unique():
-                        df_plot = df_filtered[df_filtered['Attribute_Number'] == i]
-                        # create Plotly scatter plot
-                        fig = px.scatter(df_plot, x='Lot_Number', y='Attribute_Value', color='Serial_Number',
-                                        labels={'Attribute_Value': 'Attribute Value', 'Lot_Number': 'Lot Number'},
-                                        title='Plot for Attribute Number: ' + str(i))
-                        # rotate Lot_Number labels by 90 degrees
-                        fig.update_layout(xaxis_tickangle=-90)
-                        # display Plotly plot using Streamlit
-                        st.plotly_chart(fig)
-                
-                elif plot and attribute_number:                 # NOTE - selection of Plot for selected Attribute_Number ###################################################################
-                        for i in attribute_number:
-                            df_plot = df_filtered[df_filtered['Attribute_Number'] == i]
-                            # create Plotly scatter plot
-                            fig = px.scatter(df_plot, x='Lot_Number', y='Attribute_Value', color='Serial_Number',
-                                            labels={'Attribute_Value': 'Attribute Value', 'Lot_Number': 'Lot Number'},
-                                            title='Plot for Attribute Number: ' + str(i))
-                            # rotate Lot_Number labels by 90 degrees
-                            fig.update_layout(xaxis_tickangle=-90)
-                            # display Plotly plot using Streamlit
-                            st.plotly_chart(fig)
+                # display summary statistics merged from the cached per-lot aggregates
+                display_summary_statistics(cells, part_number, None, None, 'Standard Deviation for All Attribute Numbers in All of Lot Numbers')
+
+                # display the control limits of the selected attribute numbers across all lot numbers
+                display_spc(spc, part_number, None)
+
+                # display the plots of the selected attribute numbers
+                display_plots(df_filtered, None)
                 # else:
                 #     # display message to select Attribute_Number
                 #     st.info('Please select Attribute Number to display plot')
@@ -162,67 +487,20 @@ if uploaded_file is not None:
                 selected_attributes = ', '.join(attribute_number)
                 st.markdown(f'<h3 style="font-size: 16px;">Attribute Number(s): {selected_attributes}</h3>', unsafe_allow_html=True)
                 # filter dataframe based on Attribute_Number
-                df_filtered = df_filtered[df_filtered['Attribute_Number'].isin(attribute_number)]
+                with stage(profile, 'filter', len(df_part)):
+                    df_filtered = df_part.iloc[select_rows(index, part_number, None, attribute_number)]
 
                 # NOTE: display filtered dataframe
                 # st.dataframe(df_filtered, width=2000)
 
-                # create checkbox to display summary statistics
-                summary = st.checkbox('Display Summary Statistics')
-
-                # if checkbox is selected, display summary statistics for the filtered dataframe
-                if summary:
-                    st.subheader('Summary Statistics')
-                    st.markdown('**Summary Statistics for All Lot Numbers**')
-                    # create a dataframe to display summary statistics for attribute_number
-                    df_summary = df_filtered.groupby(['Attribute_Number']).agg({'Attribute_Value': ['count', 'mean', 'std', 'min', 'max']})
-                    # rename columns
-                    df_summary.columns = ['Count', 'Mean', 'Standard Deviation', 'Minimum', 'Maximum']
-                    # sort df_summary by Attribute_Number
-                    df_summary = df_summary.sort_index()
-                    # display summary statistics dataframe
-                    st.dataframe(df_summary, width=2000)
-
-                    # create checkbox to plot the std of each attribute number
-                    plot_std = st.checkbox('Plot Standard Deviation')
-
-                    # if checkbox is selected, display scatter plot for the std of each attribute number
-                    if plot_std:
-                        # create Plotly scatter plot
-                        fig = px.scatter(df_summary, x=df_summary.index, y='Standard Deviation', title=f'Standard Deviation for Attribute Number(s): {selected_attributes}')
-                        fig.update_layout(xaxis_tickangle=-90)
-                        fig.update_xaxes(type='category', dtick=1)
-                        fig.update_traces(mode='lines+markers', line=dict(color='blue'), marker=dict(color='blue'))
-                        # display Plotly plot using Streamlit
-                        st.plotly_chart(fig)
-
-                # create checkbox to display plot
-                plot = st.checkbox('Display Plot')
-
-                # if checkbox is selected and attribute_number is not empty, iterate through all the selected Attribute_Number and display Plotly plot for each Attribute_Number
-                if plot and 'All' in attribute_number:              # NOTE - selection of Plot ###############################################################################################
-                    for i in df_filtered['Attribute_Number'].unique():
-                        df_plot = df_filtered[df_filtered['Attribute_Number'] == i]
-                        # create Plotly scatter plot
-                        fig = px.scatter(df_plot, x='Lot_Number', y='Attribute_Value', color='Serial_Number',
-                                        labels={'Attribute_Value': 'Attribute Value', 'Lot_Number': 'Lot Number'},
-                                        title='Plot for Attribute Number: ' + str(i))
-                        # rotate Lot_Number labels by 90 degrees
-                        fig.update_layout(xaxis_tickangle=-90)
-                        # display Plotly plot using Streamlit
-                        st.plotly_chart(fig)
-                
-                elif plot and attribute_number:                     # NOTE - selection of Plot for selected Attribute_Number ###################################################################
-                        for i in attribute_number:
-                            df_plot = df_filtered[df_filtered['Attribute_Number'] == i]
-                            # create Plotly scatter plot
-                            fig = px.scatter(df_plot, x='Lot_Number', y='Attribute_Value', color='Serial_Number',
-                                            labels={'Attribute_Value': 'Attribute Value', 'Lot_Number': 'Lot Number'},
-                                            title='Plot for Attribute Number: ' + str(i))
-                            # rotate Lot_Number labels by 90 degrees
-                            fig.update_layout(xaxis_tickangle=-90)
-                            # display Plotly plot using Streamlit
-                            st.plotly_chart(fig)
+                # display summary statistics merged from the cached per-lot aggregates
+                display_summary_statistics(cells, part_number, None, attribute_number, f'Standard Deviation for Attribute Number(s): {selected_attributes}')
+
+                # display the control limits of the selected attribute numbers across all lot numbers
+                display_spc(spc, part_number, attribute_number)
+
+                # display the plots of the selected attribute numbers
+                display_plots(df_filtered, attribute_number)
                 # else:
                 #     # display message to select Attribute_Number
                 #     st.info('Please select Attribute Number to display plot')
@@ -235,16 +513,11 @@ if uploaded_file is not None:
             # display subheader
             st.markdown('<h3 style="font-size: 16px;">Lot Number: ' + str(lot_number) + '</h3>', unsafe_allow_html=True)
             # filter dataframe based on Lot_Number
-            df_filtered = df_filtered[df_filtered['Lot_Number'].isin(lot_number)]
+            with stage(profile, 'filter', len(df_part)):
+                df_filtered = df_part.iloc[select_rows(index, part_number, lot_number)]
 
-            # create empty list to store Attribute_Number
-            attribute_number = []
-            # loop through filtered dataframe and append unique Attribute_Number to list
-            for i in df_filtered['Attribute_Number'].unique():
-                attribute_number.append(i)
-
-            # add an option to select all attribute numbers
-            attribute_number.append('All')
+            # get the Attribute_Number list of the selected lots and add an option to select all attribute numbers
+            attribute_number = lot_attributes(index, part_number, lot_number) + ['All']
 
             # display a dataframe that shows the Attribute_Number and its corresponding Attribute_Description
             st.subheader('Attribute Number and Attribute Description')
@@ -259,62 +532,14 @@ if uploaded_file is not None:
                 # NOTE: display filtered dataframe
                 # st.dataframe(df_filtered, width=2000)
 
-                # create checkbox to display summary statistics
-                summary = st.checkbox('Display Summary Statistics')
-
-                # if checkbox is selected, display summary statistics for the filtered dataframe
-                if summary:
-                    st.subheader('Summary Statistics')
-                    st.markdown('**Summary Statistics for All Lot Numbers**')
-                    # create a dataframe to display summary statistics for attribute_number
-                    df_summary = df_filtered.groupby(['Attribute_Number']).agg({'Attribute_Value': ['count', 'mean', 'std', 'min', 'max']})
-                    # rename columns
-                    df_summary.columns = ['Count', 'Mean', 'Standard Deviation', 'Minimum', 'Maximum']
-                    # sort df_summary by Attribute_Number
-                    df_summary = df_summary.sort_index()
-                    # display summary statistics dataframe
-                    st.dataframe(df_summary, width=2000)
-
-                    # create checkbox to plot the std of each attribute number
-                    plot_std = st.checkbox('Plot Standard Deviation')
-
-                    # if checkbox is selected, display scatter plot for the std of each attribute number
-                    if plot_std:
-                        # create Plotly scatter plot
-                        fig = px.scatter(df_summary, x=df_summary.index, y='Standard Deviation', title='Standard Deviation for All Attribute Numbers in All of Lot Numbers')
-                        fig.update_layout(xaxis_tickangle=-90)
-                        fig.update_xaxes(type='category', dtick=1)
-                        fig.update_traces(mode='lines+markers', line=dict(color='blue'), marker=dict(color='blue'))
-                        # display Plotly plot using Streamlit
-                        st.plotly_chart(fig)
-
-                # create checkbox to display plot
-                plot = st.checkbox('Display Plot')
-
-                # if checkbox is selected and attribute_number is not empty, iterate through all the selected Attribute_Number and display Plotly plot for each Attribute_Number
-                if plot and 'All' in attribute_number:                  # NOTE - selection of Plot ###############################################################################################
-                    for i in df_filtered['Attribute_Number'].unique():
-                        df_plot = df_filtered[df_filtered['Attribute_Number'] == i]
-                        # create Plotly scatter plot
-                        fig = px.scatter(df_plot, x='Lot_Number', y='Attribute_Value', color='Serial_Number',
-                                        labels={'Attribute_Value': 'Attribute Value', 'Lot_Number': 'Lot Number'},
-                                        title='Plot for Attribute Number: ' + str(i))
-                        # rotate Lot_Number labels by 90 degrees
-                        fig.update_layout(xaxis_tickangle=-90)
-                        # display Plotly plot using Streamlit
-                        st.plotly_chart(fig)
-                
-                elif plot and attribute_number:                         # NOTE - selection of Plot for selected Attribute_Number ###################################################################
-                        for i in attribute_number:
-                            df_plot = df_filtered[df_filtered['Attribute_Number'] == i]
-                            # create Plotly scatter plot
-                            fig = px.scatter(df_plot, x='Lot_Number', y='Attribute_Value', color='Serial_Number',
-                                            labels={'Attribute_Value': 'Attribute Value', 'Lot_Number': 'Lot Number'},
-                                            title='Plot for Attribute Number: ' + str(i))
-                            # rotate Lot_Number labels by 90 degrees
-                            fig.update_layout(xaxis_tickangle=-90)
-                            # display Plotly plot using Streamlit
-                            st.plotly_chart(fig)
+                # display summary statistics merged from the cached per-lot aggregates
+                display_summary_statistics(cells, part_number, lot_number, None, 'Standard Deviation for All Attribute Numbers in All of Lot Numbers')
+
+                # display the control limits of the selected attribute numbers across all lot numbers
+                display_spc(spc, part_number, None)
+
+                # display the plots of the selected attribute numbers
+                display_plots(df_filtered, None)
                 # else:
                 #     # display message to select Attribute_Number
                 #     st.info('Please select Attribute Number to display plot')
@@ -325,67 +550,20 @@ if uploaded_file is not None:
                 selected_attributes = ', '.join(attribute_number)
                 st.markdown(f'<h3 style="font-size: 16px;">Attribute Number(s): {selected_attributes}</h3>', unsafe_allow_html=True)
                 # filter dataframe based on Attribute_Number
-                df_filtered = df_filtered[df_filtered['Attribute_Number'].isin(attribute_number)]
+                with stage(profile, 'filter', len(df_part)):
+                    df_filtered = df_part.iloc[select_rows(index, part_number, lot_number, attribute_number)]
 
                 # NOTE: display filtered dataframe
                 # st.dataframe(df_filtered, width=2000)
 
-                # create checkbox to display summary statistics
-                summary = st.checkbox('Display Summary Statistics')
-
-                # if checkbox is selected, display summary statistics for the filtered dataframe
-                if summary:
-                    st.subheader('Summary Statistics')
-                    st.markdown('**Summary Statistics for All Lot Numbers**')
-                    # create a dataframe to display summary statistics for attribute_number
-                    df_summary = df_filtered.groupby(['Attribute_Number']).agg({'Attribute_Value': ['count', 'mean', 'std', 'min', 'max']})
-                    # rename columns
-                    df_summary.columns = ['Count', 'Mean', 'Standard Deviation', 'Minimum', 'Maximum']
-                    # sort df_summary by Attribute_Number
-                    df_summary = df_summary.sort_index()
-                    # display summary statistics dataframe
-                    st.dataframe(df_summary, width=2000)
-
-                    # create checkbox to plot the std of each attribute number
-                    plot_std = st.checkbox('Plot Standard Deviation')
-
-                    # if checkbox is selected, display scatter plot for the std of each attribute number
-                    if plot_std:
-                        # create Plotly scatter plot
-                        fig = px.scatter(df_summary, x=df_summary.index, y='Standard Deviation', title=f'Standard Deviation for Attribute Number(s): {selected_attributes}')
-                        fig.update_layout(xaxis_tickangle=-90)
-                        fig.update_xaxes(type='category', dtick=1)
-                        fig.update_traces(mode='lines+markers', line=dict(color='blue'), marker=dict(color='blue'))
-                        # display Plotly plot using Streamlit
-                        st.plotly_chart(fig)
-
-                # create checkbox to display plot
-                plot = st.checkbox('Display Plot')
-
-                # if checkbox is selected and attribute_number is not empty, iterate through all the selected Attribute_Number and display Plotly plot for each Attribute_Number
-                if plot and 'All' in attribute_number:                      # NOTE - selection of Plot ###############################################################################################
-                    for i in df_filtered['Attribute_Number'].unique():
-                        df_plot = df_filtered[df_filtered['Attribute_Number'] == i]
-                        # create Plotly scatter plot
-                        fig = px.scatter(df_plot, x='Lot_Number', y='Attribute_Value', color='Serial_Number',
-                                        labels={'Attribute_Value': 'Attribute Value', 'Lot_Number': 'Lot Number'},
-                                        title='Plot for Attribute Number: ' + str(i))
-                        # rotate Lot_Number labels by 90 degrees
-                        fig.update_layout(xaxis_tickangle=-90)
-                        # display Plotly plot using Streamlit
-                        st.plotly_chart(fig)
-                
-                elif plot and attribute_number:                               # NOTE - selection of Plot for selected Attribute_Number ###################################################################
-                        for i in attribute_number:
-                            df_plot = df_filtered[df_filtered['Attribute_Number'] == i]
-                            # create Plotly scatter plot
-                            fig = px.scatter(df_plot, x='Lot_Number', y='Attribute_Value', color='Serial_Number',
-                                            labels={'Attribute_Value': 'Attribute Value', 'Lot_Number': 'Lot Number'},
-                                            title='Plot for Attribute Number: ' + str(i))
-                            # rotate Lot_Number labels by 90 degrees
-                            fig.update_layout(xaxis_tickangle=-90)
-                            # display Plotly plot using Streamlit
-                            st.plotly_chart(fig)
+                # display summary statistics merged from the cached per-lot aggregates
+                display_summary_statistics(cells, part_number, lot_number, attribute_number, f'Standard Deviation for Attribute Number(s): {selected_attributes}')
+
+                # display the control limits of the selected attribute numbers across all lot numbers
+                display_spc(spc, part_number, attribute_number)
+
+                # display the plots of the selected attribute numbers
+                display_plots(df_filtered, attribute_number)
                 # else:
                 #     # display message to select Attribute_Number
                 #     st.info('Please select Attribute Number to display plot')
@@ -397,4 +575,13 @@ if uploaded_file is not None:
             st.info('Please select Lot Number')
     else:
         # display message to select a Part_Number
-        st.info('Please select a Part Number')
\ No newline at end of file
+        st.info('Please select a Part Number')
+
+# display the stage timings of the rerun in a collapsible sidebar panel, and append them to the log if one is set
+if profile is not None:
+    with st.sidebar.expander('Debug: Stage Timings', expanded=True):
+        st.dataframe(profile_table(profile))
+        st.caption('Cached stages show the time of the cache lookup.' + (' Peak memory is traced by tracemalloc, which slows down '
+                   'the stages, and excludes pyarrow buffers.' if profile['trace_memory'] else ''))
+    if PROFILE_LOG:
+        write_profile_log(PROFILE_LOG, profile, dataset=dataset_key, part=part_number)
@@ -0,0 +1,219 @@
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import plotly
+
+from toric_optic_metrology_data import (build_index, cell_stats, custom_sort, derive_attributes, load_rules, normalize,
+                                        read_file_bytes, select_rows, summary_stats)
+from toric_optic_metrology_plots import MAX_POINTS, attribute_figure, attribute_groups, batched_figure, downsample_points
+from toric_optic_metrology_spc import build_spc
+
+# default config file of the derived attribute rules
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'derived_attributes.json')
+
+# default JSON lines file the results of every run are appended to
+RESULTS_FILE = 'benchmark_results.jsonl'
+
+# largest number of rows written to the Excel parse benchmark (the row limit of a worksheet)
+EXCEL_MAX_ROWS = 1048575
+
+
+# function to generate a synthetic dataset in the schema of the app: every part has lots x serials x attributes rows
+# the first parts reuse the Part_Numbers of the derived attribute rules so the rules are exercised
+def synthetic_dataset(parts, lots, serials, attributes, seed=0):
+    rng = np.random.default_rng(seed)
+    rule_parts = ['PRD11340', 'PRD11504', 'PRD11566', 'PRD11601', 'PRD11602', 'PRD11505', 'PRD11506', 'PRD11582', 'PRD11583']
+    part_numbers = (rule_parts + [f'PRD{20000 + i}' for i in range(parts)])[:parts]
+    # mix numeric and alphanumeric lot and attribute numbers like the real exports, so custom_sort sees both
+    lot_numbers = [str(100000 + i) if i % 2 else f'L{i:05d}' for i in range(lots)]
+    serial_numbers = [f'S{i:04d}' for i in range(serials)]
+    attribute_numbers = [str(i + 1) if i % 3 else f'A{i + 1}' for i in range(attributes)]
+
+    # one row per part x lot x serial x attribute, in the nested order of an export
+    part, lot, serial, attribute = (a.ravel() for a in np.meshgrid(np.arange(parts), np.arange(lots), np.arange(serials),
+                                                                   np.arange(attributes), indexing='ij'))
+    # every attribute has its own nominal and spread, and every lot drifts slightly
+    nominal = rng.uniform(-5, 20, size=(parts, attributes))
+    spread = rng.uniform(0.01, 0.5, size=(parts, attributes))
+    drift = rng.normal(0, 0.1, size=(parts, lots, attributes))
+    values = nominal[part, attribute] + drift[part, lot, attribute] + spread[part, attribute] * rng.standard_normal(len(part))
+
+    return pd.DataFrame({
+        'Part_Number': np.array(part_numbers)[part],
+        'Part_Description': np.array([f'Toric Optic {p}' for p in part_numbers])[part],
+        'Lot_Number': np.array(lot_numbers)[lot],
+        'Serial_Number': np.array(serial_numbers)[serial],
+        'Attribute_Number': np.array(attribute_numbers)[attribute],
+        'Attribute_Description': np.array([f'Attribute {a}' for a in attribute_numbers])[attribute],
+        'Attribute_Value': values.round(6),
+    })
+
+
+# function to time a stage as the best of repeat runs, returning its result and the seconds of the fastest run
+def timed(stage, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = stage()
+        seconds.append(time.perf_counter() - start)
+    return result, min(seconds)
+
+
+# function to get the commit of the benchmarked code, if it is a git checkout
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# function to run every stage on a synthetic dataset, returning {stage: (seconds, rows)}
+def run_benchmark(df, rules, repeat=3, excel=True, max_points=MAX_POINTS):
+    results = {}
+
+    # parse the exports the app accepts
+    csv_bytes = df.to_csv(index=False).encode()
+    raw, seconds = timed(lambda: read_file_bytes('benchmark.csv', csv_bytes), repeat)
+    results['parse_csv'] = (seconds, len(raw))
+    if excel and len(df) <= EXCEL_MAX_ROWS:
+        buffer = io.BytesIO()
+        df.to_excel(buffer, sheet_name='Sheet1', index=False)
+        excel_bytes = buffer.getvalue()
+        _, seconds = timed(lambda: read_file_bytes('benchmark.xlsx', excel_bytes), repeat)
+        results['parse_excel'] = (seconds, len(df))
+
+    # normalize, derive and index the dataset the way the app does once per upload
+    df, seconds = timed(lambda: normalize(raw), repeat)
+    results['normalize'] = (seconds, len(df))
+    df, seconds = timed(lambda: derive_attributes(df, rules), repeat)
+    results['derive_attributes'] = (seconds, len(df))
+    index, seconds = timed(lambda: build_index(df), repeat)
+    results['build_index'] = (seconds, len(df))
+
+    # build the option lists of every part with custom_sort, from the raw columns as well as from the index
+    def sort_options():
+        for part, rows in index['part_rows'].items():
+            df_part = df.iloc[rows]
+            sorted(df_part['Lot_Number'].unique(), key=custom_sort)
+            sorted(df_part['Attribute_Number'].unique(), key=custom_sort)
+        return sorted(df['Part_Number'].unique(), key=custom_sort)
+    parts, seconds = timed(sort_options, repeat)
+    results['unique_sort'] = (seconds, len(df))
+
+    # filter the first part to half of its lots and attributes with a boolean mask and through the index
+    part = parts[0]
+    lots = index['lots'][part][::2]
+    attributes = index['attributes'][part][::2]
+    def mask_filter():
+        return df[(df['Part_Number'] == part) & df['Lot_Number'].isin(lots) & df['Attribute_Number'].isin(attributes)]
+    df_masked, seconds = timed(mask_filter, repeat)
+    results['filter_mask'] = (seconds, len(df))
+    df_filtered, seconds = timed(lambda: df.iloc[index['part_rows'][part]].iloc[select_rows(index, part, lots, attributes)], repeat)
+    results['filter_index'] = (seconds, len(df_filtered))
+    assert len(df_masked) == len(df_filtered)
+
+    # summarize with a full groupby and from the cached cell aggregates
+    cells, seconds = timed(lambda: cell_stats(df), repeat)
+    results['cell_stats'] = (seconds, len(df))
+    _, seconds = timed(lambda: summary_stats(cells, part, lots, attributes), repeat)
+    results['summary_stats'] = (seconds, len(cells))
+    _, seconds = timed(lambda: build_spc(cells), repeat)
+    results['build_spc'] = (seconds, len(cells))
+
+    # build and serialize the plots of the filtered part, one figure per attribute and one batched figure
+    groups = attribute_groups(df_filtered)
+    def individual_figures():
+        return [attribute_figure(downsample_points(df_filtered.iloc[rows], max_points), i).to_json() for i, rows in groups.items()]
+    _, seconds = timed(individual_figures, repeat)
+    results['figures_individual'] = (seconds, len(df_filtered))
+    _, seconds = timed(lambda: batched_figure(df_filtered, groups, list(groups), max_points=max_points).to_json(), repeat)
+    results['figure_batched'] = (seconds, len(df_filtered))
+
+    return results
+
+
+# function to find the last recorded result with the same dataset size, to compare a run against
+def previous_result(path, size):
+    if not os.path.isfile(path):
+        return None
+    previous = None
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('size') == size:
+                previous = record
+    return previous
+
+
+# function to parse the command line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Time the stages of the app on a synthetic dataset and record the results.')
+    parser.add_argument('--parts', type=int, default=10, help='number of Part_Numbers (default: 10)')
+    parser.add_argument('--lots', type=int, default=50, help='number of Lot_Numbers per part (default: 50)')
+    parser.add_argument('--serials', type=int, default=10, help='number of Serial_Numbers per lot (default: 10)')
+    parser.add_argument('--attributes', type=int, default=40, help='number of Attribute_Numbers per part (default: 40)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic values (default: 0)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of every stage, the fastest is recorded (default: 3)')
+    parser.add_argument('--no-excel', action='store_true', help='skip the Excel parse, which dominates the run on large datasets')
+    parser.add_argument('--max-points', type=int, default=MAX_POINTS,
+                        help=f'point budget per plot, 0 keeps every point (default: {MAX_POINTS})')
+    parser.add_argument('--rules', default=RULES_FILE, help='config file of the derived attribute rules')
+    parser.add_argument('-o', '--output', default=RESULTS_FILE, help=f'JSON lines file the results are appended to (default: {RESULTS_FILE})')
+    parser.add_argument('--write-dataset', help='also write the synthetic dataset to this CSV or Excel file and exit')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    size = {'parts': args.parts, 'lots': args.lots, 'serials': args.serials, 'attributes': args.attributes}
+    df = synthetic_dataset(seed=args.seed, **size)
+
+    # write the dataset for use in the app instead of benchmarking it
+    if args.write_dataset:
+        if args.write_dataset.endswith('.xlsx'):
+            df.to_excel(args.write_dataset, sheet_name='Sheet1', index=False)
+        else:
+            df.to_csv(args.write_dataset, index=False)
+        print(f'Wrote {len(df)} rows to {args.write_dataset}')
+        return 0
+
+    print(f'Benchmarking {len(df)} rows ({args.parts} parts x {args.lots} lots x {args.serials} serials x {args.attributes} attributes)')
+    results = run_benchmark(df, load_rules(args.rules), args.repeat, not args.no_excel, args.max_points or None)
+
+    # compare every stage with the last run of the same size
+    previous = previous_result(args.output, size)
+    for stage, (seconds, rows) in results.items():
+        change = ''
+        if previous and stage in previous['stages']:
+            change = f'{seconds / previous["stages"][stage]["seconds"] - 1:+.0%} vs {previous["commit"] or previous["timestamp"]}'
+        print(f'{stage:<20} {seconds:>10.4f}s {rows:>12} rows  {change}')
+
+    record = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'size': size,
+        'rows': len(df),
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+        'stages': {stage: {'seconds': seconds, 'rows': rows} for stage, (seconds, rows) in results.items()},
+    }
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    print(f'Appended results to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,566 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# key columns of a dataset
+KEY_COLUMNS = ['Part_Number', 'Lot_Number', 'Serial_Number', 'Attribute_Number']
+
+# columns every dataset must have
+REQUIRED_COLUMNS = KEY_COLUMNS + ['Part_Description', 'Attribute_Description', 'Attribute_Value']
+
+# columns tagging every row with the file and sheet it was read from
+SOURCE_COLUMNS = ['Source_File', 'Source_Sheet']
+
+# columns stored as categoricals
+CATEGORY_COLUMNS = KEY_COLUMNS + ['Part_Description', 'Attribute_Description'] + SOURCE_COLUMNS
+
+# number of CSV rows parsed per chunk in streaming mode
+CSV_CHUNK_ROWS = 250000
+
+# significant digits of a float32 value, statistics of Attribute_Value are rounded to them for display and export
+FLOAT32_DIGITS = 7
+
+# comparisons available to derived attribute rules
+RULE_OPERATORS = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal, '==': np.equal}
+
+
+# function to sort alpha first then numeric values
+def custom_sort(item):
+    if item.isdigit():
+        return (float('inf'), int(item))
+    else:
+        return (0, item)
+
+
+# function to estimate the memory held by a loaded object: dataframes, series and indexes by their memory usage
+# including their strings, arrays by their buffers, and dictionaries, lists and tuples by their items
+def memory_size(obj):
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(memory_size(key) + memory_size(value) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(memory_size(item) for item in obj)
+    return sys.getsizeof(obj)
+
+
+# function to compute a content hash of the uploaded file bytes
+def file_hash(file_bytes):
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+# function to parse the bytes (or the path) of an uploaded Excel (one sheet of it) or CSV file into a dataframe
+def read_file_bytes(file_name, file_bytes, sheet_name='Sheet1'):
+    source = io.BytesIO(file_bytes) if isinstance(file_bytes, bytes) else file_bytes
+    if file_name.endswith('.xlsx'):
+        return pd.read_excel(source, sheet_name=sheet_name)
+    elif file_name.endswith('.csv'):
+        return pd.read_csv(source)
+    else:
+        raise ValueError(f'Invalid file format: {file_name}')
+
+
+# function to list the sheets of an Excel file (bytes or path), a CSV file is a single sheet without a name
+def sheet_names(file_name, file_bytes):
+    if file_name.endswith('.xlsx'):
+        return pd.ExcelFile(io.BytesIO(file_bytes) if isinstance(file_bytes, bytes) else file_bytes).sheet_names
+    return [None]
+
+
+# function to parse one sheet of a file (bytes or path) and tag its rows with the file and sheet
+def read_sheet(file_name, file_bytes, sheet_name=None):
+    df = read_file_bytes(file_name, file_bytes, sheet_name)
+    df['Source_File'] = file_name
+    df['Source_Sheet'] = sheet_name
+    return df
+
+
+# function to parse the sheets of several files concurrently in a process pool and concatenate them into one dataset
+# files are (file_name, file_bytes) pairs, or (file_name, path) pairs for files on disk, and sheets maps a file name to the
+# sheets to read, all sheets when it is missing; sheets that were not selected by name are skipped when they don't have
+# the dataset columns
+# returns the dataset and warnings about the skipped sheets and the non-numeric values left missing
+def read_files(files, sheets=None, workers=None):
+    sheets = sheets or {}
+    tasks = [(n, sheet) for n, (name, data) in enumerate(files) for sheet in sheets.get(name) or sheet_names(name, data)]
+    if len(tasks) == 1:
+        frames = [read_sheet(files[0][0], files[0][1], tasks[0][1])]
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # write the bytes of every file to disk once, so the workers open their sheets from there instead of
+            # each being sent a pickled copy of the whole file
+            sources = []
+            for n, (name, data) in enumerate(files):
+                if isinstance(data, bytes):
+                    path = os.path.join(tmp_dir, f'{n}-{os.path.basename(name)}')
+                    with open(path, 'wb') as f:
+                        f.write(data)
+                    data = path
+                sources.append(data)
+            with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(tasks))) as executor:
+                frames = list(executor.map(read_sheet, [files[n][0] for n, _ in tasks], [sources[n] for n, _ in tasks],
+                                           [sheet for _, sheet in tasks]))
+
+    datasets = []
+    skipped = []
+    warnings = []
+    for (n, sheet), df in zip(tasks, frames):
+        name = files[n][0]
+        source = name if sheet is None else f'{name}: {sheet}'
+        if sheets.get(name) or set(REQUIRED_COLUMNS) <= set(df.columns):
+            try:
+                not_numeric = validate_schema(df)
+            except ValueError as e:
+                raise ValueError(f'{source}: {e}') from None
+            if not_numeric:
+                warnings.append(f'{source}: {not_numeric} non-numeric Attribute_Value(s) left missing')
+            datasets.append(df)
+        else:
+            skipped.append(source)
+    if not datasets:
+        raise ValueError('No sheet has the dataset columns: ' + ', '.join(REQUIRED_COLUMNS))
+    if skipped:
+        warnings.insert(0, 'Skipped sheet(s) without the dataset columns: ' + ', '.join(skipped))
+    return normalize(pd.concat(datasets, ignore_index=True)), warnings
+
+
+# function to read a dataset from paths: Excel or CSV files (all their sheets), or a dataset directory of the columnar store
+def read_path(*paths, sheets=None, workers=None):
+    if len(paths) == 1 and os.path.isdir(paths[0]):
+        return read_store(paths[0])
+    return read_files([(os.path.basename(path), path) for path in paths], sheets, workers)[0]
+
+
+# function to get the sort key of every row of a normalized dataset: the codes of its Part_Number, Lot_Number and
+# Attribute_Number combined into one integer, with missing keys sorted last
+def cell_order(df):
+    key = np.zeros(len(df), dtype=np.int64)
+    for col in ['Part_Number', 'Lot_Number', 'Attribute_Number']:
+        codes = df[col].cat.codes.to_numpy().astype(np.int64)
+        size = len(df[col].cat.categories)
+        key = key * (size + 1) + np.where(codes < 0, size, codes)
+    return key
+
+
+# function to normalize a dataset at load time into its memory-compact form: categorical keys and descriptions,
+# float32 values and rows ordered by Part_Number, Lot_Number and Attribute_Number, so every part and every
+# (part, lot, attribute) cell is a contiguous block that can be sliced without copying
+def normalize(df):
+    df = df.copy(deep=False)
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            # keep the keys as strings so custom_sort works on every value, leaving missing values missing
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str)).astype('category')
+        elif col in df.columns and not df[col].cat.categories.is_monotonic_increasing:
+            # keep the categories sorted after datasets with different categories are combined
+            df[col] = df[col].cat.reorder_categories(df[col].cat.categories.sort_values())
+    df['Attribute_Value'] = pd.to_numeric(df['Attribute_Value'], errors='coerce').astype('float32')
+    key = cell_order(df)
+    if (np.diff(key) < 0).any():
+        df = df.take(np.argsort(key, kind='stable')).reset_index(drop=True)
+    return df
+
+
+# function to get the directory of a stored dataset from its content hash
+def store_path(store_dir, content_hash):
+    return os.path.join(store_dir, content_hash)
+
+
+# function to list the stored datasets as a dictionary of content hash to source file name
+def list_store(store_dir):
+    datasets = {}
+    if not os.path.isdir(store_dir):
+        return datasets
+    for content_hash in sorted(os.listdir(store_dir)):
+        # skip the temporary directories of conversions in progress or interrupted
+        if content_hash.startswith(('_', '.')) or content_hash.endswith('.tmp'):
+            continue
+        part_file = os.path.join(store_dir, content_hash, 'part-00000.parquet')
+        if os.path.isfile(part_file):
+            try:
+                metadata = pq.read_schema(part_file).metadata or {}
+            except (OSError, pa.ArrowInvalid):
+                # an unreadable dataset is left out rather than breaking the list of every session
+                continue
+            datasets[content_hash] = metadata.get(b'source_name', content_hash.encode()).decode()
+    return datasets
+
+
+# function to convert a dataframe into an Arrow table of the store, optionally aligned to the schema of its dataset
+def store_table(df, schema=None):
+    table = pa.Table.from_pandas(normalize(df), preserve_index=False)
+    # widen the dictionary indices so every file of a dataset shares one schema whatever its number of categories
+    fields = [pa.field(field.name, pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type) else field
+              for field in table.schema]
+    table = table.cast(pa.schema(fields, metadata=table.schema.metadata))
+    if schema is not None:
+        # keep the columns of the dataset, filling the ones the new rows don't have with nulls
+        table = pa.table([table[name] if name in table.column_names else pa.nulls(len(table), schema.field(name).type)
+                          for name in schema.names], schema=schema)
+    return table
+
+
+# function to convert a dataframe once into a compressed columnar dataset in the store
+def write_store(df, store_dir, content_hash, source_name):
+    path = store_path(store_dir, content_hash)
+    if os.path.isdir(path):
+        return path
+    table = store_table(df)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'source_name': source_name.encode()})
+    # write to a temporary directory of its own that list_store skips, then rename it into place
+    os.makedirs(store_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=f'_{content_hash}.', suffix='.tmp', dir=store_dir)
+    try:
+        pq.write_table(table, os.path.join(tmp_path, 'part-00000.parquet'), compression='zstd')
+        os.replace(tmp_path, path)
+    except OSError:
+        # another session stored the same content first, keep its dataset
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    return path
+
+
+# function to open a stored dataset, decompressing its columnar files into a dataframe
+# NOTE: the rows are copied into memory, the savings over a parsed upload come from the categorical columns and float32 values
+def read_store(path):
+    return normalize(pq.read_table(path).to_pandas())
+
+
+# function to build the Part_Number -> Lot_Number -> Attribute_Number index of a normalized dataset
+# 'part_rows' holds the slice of rows of each part, and the cells are stored CSR-style: 'cell_starts' and 'cell_stops'
+# hold the rows of every (part, lot, attribute) cell in the order of the cell_stats index, with the codes of its lot and
+# attribute in 'cell_lots' and 'cell_attributes', and 'part_cells' holds the slice of cells of each part
+def build_index(df):
+    keys = ['Part_Number', 'Lot_Number', 'Attribute_Number']
+    codes = [df[key].cat.codes.to_numpy() for key in keys]
+    categories = [df[key].cat.categories for key in keys]
+
+    # normalize sorts the rows by cell, so every cell is a run of rows with the same key
+    key = cell_order(df)
+    starts = np.flatnonzero(np.diff(key, prepend=-1))
+    stops = np.append(starts[1:], len(df))
+    # rows with a missing key belong to no cell
+    valid = (codes[0][starts] >= 0) & (codes[1][starts] >= 0) & (codes[2][starts] >= 0)
+    cell_starts, cell_stops = starts[valid], stops[valid]
+    cell_parts, cell_lots, cell_attributes = (c[cell_starts] for c in codes)
+
+    # every part is a run of rows too, including its rows with a missing lot or attribute
+    part_starts = np.flatnonzero(np.diff(codes[0].astype(np.int64), prepend=-2))
+    part_stops = np.append(part_starts[1:], len(df))
+    part_codes = codes[0][part_starts]
+    part_starts, part_stops, part_codes = part_starts[part_codes >= 0], part_stops[part_codes >= 0], part_codes[part_codes >= 0]
+    parts = categories[0][part_codes]
+    cell_bounds = np.searchsorted(cell_parts, np.append(part_codes, len(categories[0])))
+
+    # precompute the sorted option lists for the sidebar
+    index = {
+        'parts': sorted(parts, key=custom_sort),
+        'part_rows': {part: slice(int(start), int(stop)) for part, start, stop in zip(parts, part_starts, part_stops)},
+        'part_cells': {part: slice(int(start), int(stop)) for part, start, stop in zip(parts, cell_bounds[:-1], cell_bounds[1:])},
+        'cell_starts': cell_starts,
+        'cell_stops': cell_stops,
+        'cell_lots': cell_lots,
+        'cell_attributes': cell_attributes,
+        'lot_categories': categories[1],
+        'attribute_categories': categories[2],
+        'part_descriptions': df[['Part_Number', 'Part_Description']].drop_duplicates().sort_values('Part_Number'),
+    }
+    index['lots'] = {part: sorted(categories[1][np.unique(cell_lots[cells])], key=custom_sort)
+                     for part, cells in index['part_cells'].items()}
+    index['attributes'] = {part: sorted(categories[2][np.unique(cell_attributes[cells])], key=custom_sort)
+                           for part, cells in index['part_cells'].items()}
+    return index
+
+
+# function to get the positions of the cells of a part that are in the selected lots and attributes (None selects all)
+def select_cells(index, part, lots=None, attributes=None):
+    cells = index['part_cells'][part]
+    mask = np.ones(cells.stop - cells.start, dtype=bool)
+    if lots is not None:
+        mask &= np.isin(index['cell_lots'][cells], index['lot_categories'].get_indexer(list(lots)))
+    if attributes is not None:
+        mask &= np.isin(index['cell_attributes'][cells], index['attribute_categories'].get_indexer(list(attributes)))
+    return cells.start + np.flatnonzero(mask)
+
+
+# function to get the sorted Attribute_Number options of the selected lots of a part
+def lot_attributes(index, part, lots):
+    cells = select_cells(index, part, lots)
+    return sorted(index['attribute_categories'][np.unique(index['cell_attributes'][cells])], key=custom_sort)
+
+
+# function to get the row positions within a part of the selected lots and attributes (None selects all)
+def select_rows(index, part, lots=None, attributes=None):
+    cells = select_cells(index, part, lots, attributes)
+    starts = index['cell_starts'][cells] - index['part_rows'][part].start
+    lengths = index['cell_stops'][cells] - index['cell_starts'][cells]
+    # expand the (start, length) runs of the cells into the positions of their rows
+    offsets = np.cumsum(lengths) - lengths
+    return (np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())).astype(np.intp)
+
+
+# function to compute count/mean/M2/min/max of Attribute_Value per (part, lot, attribute) cell in one groupby pass
+# M2 is the sum of squared deviations from the cell mean, so cells can be merged without rescanning rows
+# the mean and M2 are accumulated in float64, the min and max keep the dtype of the values
+def cell_stats(df):
+    keys = ['Part_Number', 'Lot_Number', 'Attribute_Number']
+    values = pd.DataFrame({'value': df['Attribute_Value'], 'value64': df['Attribute_Value'].astype('float64')})
+    cells = values.groupby([df[key] for key in keys], observed=True).agg(
+        count=('value64', 'count'), mean=('value64', 'mean'), var=('value64', 'var'), min=('value', 'min'), max=('value', 'max'))
+    cells['m2'] = (cells.pop('var') * (cells['count'] - 1)).fillna(0.0)
+    return cells[['count', 'mean', 'm2', 'min', 'max']].sort_index()
+
+
+# function to merge cell aggregates that share the same keys with the parallel (Chan) variance combination
+def merge_cells(cells, keys):
+    grouped = cells.groupby(level=keys, observed=True)
+    weighted = (cells['mean'] * cells['count']).groupby(level=keys, observed=True)
+    # add the spread of the cell means around the merged mean to the cells' own M2
+    mean = weighted.transform('sum') / grouped['count'].transform('sum')
+    m2 = (cells['m2'] + cells['count'] * (cells['mean'] - mean) ** 2).groupby(level=keys, observed=True).sum()
+    count = grouped['count'].sum()
+    return pd.DataFrame({'count': count, 'mean': (weighted.sum() / count).where(count > 0), 'm2': m2,
+                         'min': grouped['min'].min(), 'max': grouped['max'].max()})
+
+
+# function to round the float columns of a table to the significant digits of float32, so statistics of the float32
+# values show 1.485242 rather than the 1.4852420091629028 of its conversion to float64
+def round_float32(df):
+    df = df.copy()
+    for col in df.select_dtypes('float').columns:
+        values = df[col].to_numpy(dtype='float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            decimals = FLOAT32_DIGITS - 1 - np.floor(np.log10(np.abs(values)))
+        decimals = np.nan_to_num(decimals, nan=0.0, posinf=0.0, neginf=0.0)
+        # scale by exact powers of ten, multiplying for decimals and dividing for tens
+        up, down = 10.0 ** np.maximum(decimals, 0), 10.0 ** np.maximum(-decimals, 0)
+        df[col] = np.round(values * up / down) * down / up
+    return df
+
+
+# function to merge cell aggregates into the per-Attribute_Number summary statistics, rounded to float32 precision
+def combine_stats(cells):
+    merged = merge_cells(cells, 'Attribute_Number')
+    std = np.sqrt(merged['m2'] / (merged['count'] - 1)).where(merged['count'] > 1)
+    df_summary = pd.DataFrame({'Count': merged['count'], 'Mean': merged['mean'], 'Standard Deviation': std,
+                               'Minimum': merged['min'], 'Maximum': merged['max']})
+    return round_float32(df_summary.sort_index())
+
+
+# function to get the per-attribute summary statistics of the selected lots and attributes of a part (None selects all)
+def summary_stats(cells, part, lots=None, attributes=None):
+    part_cells = cells.xs(part, level='Part_Number', drop_level=False)
+    if lots is not None:
+        part_cells = part_cells[part_cells.index.get_level_values('Lot_Number').isin(lots)]
+    if attributes is not None:
+        part_cells = part_cells[part_cells.index.get_level_values('Attribute_Number').isin(attributes)]
+    return combine_stats(part_cells)
+
+
+# function to resolve a CSV path given relative to the server data directory, returning None unless it is a file
+# inside that directory, so paths such as ../../etc/passwd or symlinks out of it can't be read
+def data_file_path(data_dir, name):
+    data_dir = os.path.realpath(data_dir)
+    path = os.path.realpath(os.path.join(data_dir, name))
+    if os.path.commonpath([data_dir, path]) != data_dir or not os.path.isfile(path):
+        return None
+    return path
+
+
+# function to iterate over a CSV file (path or file object) in chunks, reporting the fraction of bytes read
+# raises ValueError when the file is not a CSV with the dataset columns, before any rows are aggregated
+def iter_csv_chunks(source, chunk_rows=CSV_CHUNK_ROWS, progress=None):
+    file = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        size = file.seek(0, os.SEEK_END)
+        file.seek(0)
+        # read the keys as strings so custom_sort works on every value
+        for n, chunk in enumerate(pd.read_csv(file, chunksize=chunk_rows, dtype={col: str for col in KEY_COLUMNS})):
+            if n == 0:
+                validate_schema(chunk)
+            # coerce non-numeric values to missing, like normalize does for a whole file
+            chunk['Attribute_Value'] = pd.to_numeric(chunk['Attribute_Value'], errors='coerce')
+            yield chunk
+            if progress is not None:
+                progress(min(1.0, file.tell() / max(size, 1)))
+    finally:
+        if isinstance(source, str):
+            file.close()
+
+
+# function to scan a CSV in chunks, accumulating the part list and the per-cell aggregates without keeping any rows
+def scan_csv(source, chunk_rows=CSV_CHUNK_ROWS, progress=None):
+    keys = ['Part_Number', 'Lot_Number', 'Attribute_Number']
+    cells = None
+    part_descriptions = None
+    for chunk in iter_csv_chunks(source, chunk_rows, progress):
+        chunk_cells = cell_stats(chunk)
+        cells = chunk_cells if cells is None else merge_cells(pd.concat([cells, chunk_cells]), keys)
+        descriptions = chunk[['Part_Number', 'Part_Description']].drop_duplicates()
+        part_descriptions = descriptions if part_descriptions is None else pd.concat([part_descriptions, descriptions]).drop_duplicates()
+
+    scan = {
+        'parts': sorted(part_descriptions['Part_Number'].dropna().unique(), key=custom_sort),
+        'part_descriptions': part_descriptions.sort_values('Part_Number'),
+        'cells': cells.sort_index(),
+    }
+    return scan
+
+
+# function to read only the rows of one Part_Number from a CSV in chunks
+def read_csv_part(source, part, chunk_rows=CSV_CHUNK_ROWS, progress=None):
+    frames = [chunk[chunk['Part_Number'] == part] for chunk in iter_csv_chunks(source, chunk_rows, progress)]
+    return normalize(pd.concat(frames, ignore_index=True))
+
+
+# function to read the derived attribute rule table from a JSON config file
+# every rule labels the Attribute_Value of its parts (and optionally one Attribute_Number) by comparing it to a threshold
+def load_rules(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        rules = json.load(f)
+    for rule in rules:
+        missing = {'name', 'parts', 'threshold', 'labels'} - set(rule)
+        if missing:
+            raise ValueError(f'Derived attribute rule {rule.get("name")} is missing {sorted(missing)}')
+        if rule.get('operator', '<=') not in RULE_OPERATORS:
+            raise ValueError(f'Derived attribute rule {rule["name"]} has an unknown operator {rule["operator"]}')
+        if len(rule['labels']) != 2:
+            raise ValueError(f'Derived attribute rule {rule["name"]} needs a pass and a fail label')
+    return rules
+
+
+# function to add the derived attribute columns of the rules to a dataset with vectorized comparisons
+# rows outside a rule's parts are left missing, and rules sharing a name fill the same column
+def derive_attributes(df, rules):
+    df = df.copy(deep=False)
+    parts = df['Part_Number']
+    attributes = df['Attribute_Number']
+    values = df['Attribute_Value'].to_numpy()
+    columns = {}
+    for rule in rules:
+        labels, codes = columns.setdefault(rule['name'], ([], np.full(len(df), -1, dtype=np.int8)))
+        for label in rule['labels']:
+            if label not in labels:
+                labels.append(label)
+        mask = parts.isin(rule['parts']).to_numpy()
+        if rule.get('attribute') is not None:
+            mask = mask & (attributes == str(rule['attribute'])).to_numpy()
+        passed = RULE_OPERATORS[rule.get('operator', '<=')](values, rule['threshold'])
+        pass_code, fail_code = labels.index(rule['labels'][0]), labels.index(rule['labels'][1])
+        codes[mask] = np.where(passed[mask], pass_code, fail_code)
+    for name, (labels, codes) in columns.items():
+        df[name] = pd.Categorical.from_codes(codes, categories=labels)
+    return df
+
+
+# function to check that new rows have the columns of a dataset, returning the number of non-numeric Attribute_Values
+def validate_schema(new_rows):
+    missing = [col for col in REQUIRED_COLUMNS if col not in new_rows.columns]
+    if missing:
+        raise ValueError(f'Missing column(s): {", ".join(missing)}')
+    # non-numeric values are not rejected, normalize leaves them missing like for any other dataset
+    not_numeric = pd.to_numeric(new_rows['Attribute_Value'], errors='coerce').isna() & new_rows['Attribute_Value'].notna()
+    return int(not_numeric.sum())
+
+
+# function to drop the new rows whose keys repeat among themselves or already exist in the dataset
+# only the existing rows of the (part, lot) pairs of the new rows are compared
+def deduplicate(df, index, new_rows):
+    new_rows = new_rows.drop_duplicates(KEY_COLUMNS, keep='last')
+    pairs = new_rows[['Part_Number', 'Lot_Number']].drop_duplicates().dropna().astype(str)
+    positions = [index['part_rows'][part].start + select_rows(index, part, lots)
+                 for part, lots in pairs.groupby('Part_Number')['Lot_Number'] if part in index['part_rows']]
+    if not positions:
+        return new_rows
+    existing = df.iloc[np.concatenate(positions)][KEY_COLUMNS].astype(str).drop_duplicates()
+    matched = new_rows[KEY_COLUMNS].astype(str).merge(existing, how='left', indicator=True)['_merge'] == 'both'
+    return new_rows[~matched.to_numpy()]
+
+
+# function to get the version of a stored dataset: the name of its last file, which changes with every append
+def store_version(path):
+    return max(name for name in os.listdir(path) if name.startswith('part-') and name.endswith('.parquet'))
+
+
+# function to write new rows as a new file of a stored dataset, returning the new version of the dataset
+# the file name is unique and sorts after every earlier file, so concurrent appends never overwrite each other
+def append_store(path, new_rows):
+    schema = pq.read_schema(os.path.join(path, 'part-00000.parquet'))
+    name = f'part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet'
+    # write under a name the dataset ignores first so a half-written file is never read
+    tmp_file = os.path.join(path, '_' + name)
+    pq.write_table(store_table(new_rows, schema), tmp_file, compression='zstd')
+    os.replace(tmp_file, os.path.join(path, name))
+    return name
+
+
+# function to concatenate new rows to a dataset, adding their categories so categorical columns stay categorical
+def concat_rows(df, new_rows):
+    new_rows = new_rows.reindex(columns=df.columns)
+    columns = {}
+    for col in df.columns:
+        old, new = df[col], new_rows[col]
+        if isinstance(old.dtype, pd.CategoricalDtype):
+            new = new.astype(object)
+            extra = pd.Index(new.dropna().unique()).difference(old.cat.categories)
+            old = old.cat.add_categories(extra)
+            new = pd.Series(pd.Categorical(new, categories=old.cat.categories))
+        columns[col] = pd.concat([old, new.astype(old.dtype)], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+# function to merge the cell aggregates of new rows into the cell aggregates of a dataset, touching only the new cells
+def extend_cells(cells, new_cells):
+    keys = ['Part_Number', 'Lot_Number', 'Attribute_Number']
+    cells = cells.set_axis(cells.index.set_levels([level.astype(str) for level in cells.index.levels]))
+    new_cells = new_cells.set_axis(new_cells.index.set_levels([level.astype(str) for level in new_cells.index.levels]))
+    overlap = new_cells.index.intersection(cells.index)
+    if len(overlap):
+        merged = merge_cells(pd.concat([cells.loc[overlap], new_cells.loc[overlap]]), keys)
+        cells = pd.concat([cells.drop(overlap), merged, new_cells.drop(overlap)])
+    else:
+        cells = pd.concat([cells, new_cells])
+    return cells.sort_index()
+
+
+# function to append new rows to a stored dataset, updating its cell aggregates in proportion to the new rows and re-indexing
+# the extended dataset in one vectorized pass
+# returns the updated dataset, index and cells, the cell aggregates of the added rows, the numbers of added and skipped rows
+# and the new version of the stored dataset (None when nothing was added)
+def append_rows(path, df, index, cells, new_rows, rules=()):
+    validate_schema(new_rows)
+    new_rows = normalize(new_rows)
+    received = len(new_rows)
+    new_rows = deduplicate(df, index, new_rows)
+    if new_rows.empty:
+        return df, index, cells, None, 0, received, None
+
+    # store the new rows as their own file, then extend the dataset in memory
+    new_rows = normalize(new_rows.reset_index(drop=True))
+    version = append_store(path, new_rows)
+    new_rows = derive_attributes(new_rows, rules)
+    new_cells = cell_stats(new_rows)
+    # normalizing moves the new rows into the cells of the dataset, so parts and cells stay contiguous and sliceable
+    extended = normalize(concat_rows(df, new_rows))
+    extended_index = build_index(extended)
+    extended_cells = extend_cells(cells, new_cells)
+    return extended, extended_index, extended_cells, new_cells, len(new_rows), received - len(new_rows), version
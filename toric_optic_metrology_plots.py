@@ -0,0 +1,138 @@
+import math
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+# number of subplot columns in a batched figure
+BATCH_COLUMNS = 3
+
+# default number of points kept per plot trace before downsampling
+MAX_POINTS = 5000
+
+
+# function to get the positions of the points kept when reducing a plot to at most max_points
+# every lot keeps evenly spaced ranks of its sorted values (so its minimum, maximum and quantiles survive)
+# plus up to half the budget of Tukey outliers, and all points of full_lot (a Lot_Number code) are kept for drill-down
+def downsample_positions(lot_codes, values, max_points, full_lot=None):
+    if max_points is None or len(values) <= max_points:
+        return np.arange(len(values))
+
+    # sort by lot then value and find the rank of every point within its lot
+    order = np.lexsort((values, lot_codes))
+    sorted_codes = lot_codes[order]
+    sorted_values = values[order]
+    sizes = np.bincount(lot_codes)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank = np.arange(len(order)) - starts[sorted_codes]
+    n = sizes[sorted_codes]
+
+    # find points beyond 1.5 interquartile ranges of their lot, keeping the most extreme half of the budget
+    q1 = sorted_values[starts + (sizes - 1) // 4][sorted_codes]
+    q3 = sorted_values[starts + 3 * (sizes - 1) // 4][sorted_codes]
+    iqr = q3 - q1
+    excess = np.maximum(q1 - sorted_values, sorted_values - q3) - 1.5 * iqr
+    outliers = np.flatnonzero(excess > 0)
+    if len(outliers) > max_points // 2:
+        outliers = outliers[np.argpartition(-excess[outliers], max_points // 2)[:max_points // 2]]
+
+    # share the rest of the budget between lots by size, with the minimum and maximum of each lot when the budget has
+    # room for them, so the kept points never add up to more than max_points
+    remaining = max_points - len(outliers)
+    floor = np.minimum(sizes, 2) if 2 * np.count_nonzero(sizes) <= remaining else np.zeros_like(sizes)
+    quota = (floor + (remaining - floor.sum()) * sizes // len(values))[sorted_codes]
+    # a lot with a quota of one keeps its median and a lot with none only keeps its outliers
+    step = (n - 1) / np.maximum(quota - 1, 1)
+    keep = (n <= quota) | (quota > 1) & (np.rint(np.rint(rank / step) * step) == rank)
+    keep |= (quota == 1) & (rank == (n - 1) // 2)
+    keep[outliers] = True
+
+    if full_lot is not None:
+        keep |= sorted_codes == full_lot
+    return np.sort(order[keep])
+
+
+# function to reduce a plot dataframe to at most max_points, keeping all points of full_lot (a Lot_Number)
+def downsample_points(df_plot, max_points, full_lot=None):
+    df_plot = df_plot[df_plot['Attribute_Value'].notna()]
+    # a missing Lot_Number is a lot of its own, like in the plot, rather than a negative code
+    lot_codes, lots = pd.factorize(df_plot['Lot_Number'], use_na_sentinel=False)
+    full_code = lots.get_loc(full_lot) if full_lot is not None and full_lot in lots else None
+    positions = downsample_positions(lot_codes, df_plot['Attribute_Value'].to_numpy(dtype='float64'), max_points, full_code)
+    return df_plot.iloc[positions]
+
+
+# function to create the Plotly plot of the standard deviation of each Attribute_Number in a summary statistics dataframe
+def std_figure(df_summary, title):
+    fig = px.scatter(df_summary, x=df_summary.index, y='Standard Deviation', title=title)
+    fig.update_layout(xaxis_tickangle=-90)
+    fig.update_xaxes(type='category', dtick=1)
+    fig.update_traces(mode='lines+markers', line=dict(color='blue'), marker=dict(color='blue'))
+    return fig
+
+
+# function to create the Plotly scatter plot of one Attribute_Number colored by Serial_Number
+def attribute_figure(df_plot, attribute):
+    fig = px.scatter(df_plot, x='Lot_Number', y='Attribute_Value', color='Serial_Number',
+                     labels={'Attribute_Value': 'Attribute Value', 'Lot_Number': 'Lot Number'},
+                     title='Plot for Attribute Number: ' + str(attribute))
+    # rotate Lot_Number labels by 90 degrees
+    fig.update_layout(xaxis_tickangle=-90)
+    return fig
+
+
+# function to create one figure with a WebGL subplot per Attribute_Number
+# groups maps each Attribute_Number to its row positions in df, so no attribute is re-masked,
+# and every subplot is downsampled to at most max_points unless its points are in full_lot
+def batched_figure(df, groups, attributes, columns=BATCH_COLUMNS, max_points=None, full_lot=None):
+    rows = max(1, math.ceil(len(attributes) / columns))
+    fig = make_subplots(rows=rows, cols=columns, subplot_titles=['Attribute Number: ' + str(i) for i in attributes],
+                        vertical_spacing=min(0.1, 0.5 / rows))
+
+    # color every point by its Serial_Number code so each subplot is a single trace
+    serial_codes = df['Serial_Number'].astype('category').cat.codes.to_numpy()
+    # a missing Lot_Number is a lot of its own, like in the plot, rather than a negative code
+    lot_codes, lot_names = pd.factorize(df['Lot_Number'], use_na_sentinel=False)
+    full_code = lot_names.get_loc(full_lot) if full_lot is not None and full_lot in lot_names else None
+    lots = df['Lot_Number'].astype(str).to_numpy()
+    serials = df['Serial_Number'].astype(str).to_numpy()
+    values = df['Attribute_Value'].to_numpy(dtype='float64')
+
+    for n, i in enumerate(attributes):
+        positions = groups[i][~np.isnan(values[groups[i]])]
+        positions = positions[downsample_positions(lot_codes[positions], values[positions], max_points, full_code)]
+        fig.add_trace(go.Scattergl(x=lots[positions], y=values[positions], text=serials[positions], mode='markers',
+                                   marker=dict(color=serial_codes[positions], colorscale='Turbo', size=5),
+                                   hovertemplate='Lot Number: %{x}<br>Attribute Value: %{y}<br>Serial Number: %{text}<extra></extra>',
+                                   showlegend=False),
+                      row=n // columns + 1, col=n % columns + 1)
+
+    # rotate Lot_Number labels by 90 degrees and keep lot numbers as categories
+    fig.update_xaxes(type='category', tickangle=-90)
+    fig.update_layout(height=300 * rows, margin=dict(t=60))
+    return fig
+
+
+# function to get the row positions of each Attribute_Number of a dataframe in one groupby pass
+def attribute_groups(df):
+    return df.groupby('Attribute_Number', observed=True, sort=False).indices
+
+
+# function to create the X-bar (or individuals) control chart of one series with its limits and rule violations
+def spc_figure(series_points, series_limits, attribute, rules):
+    fig = go.Figure()
+    lots = series_points['Lot_Number'].astype(str)
+    fig.add_trace(go.Scatter(x=lots, y=series_points['xbar'], mode='lines+markers', name='Lot Mean',
+                             line=dict(color='blue'), marker=dict(color='blue')))
+    # mark the lots that violate any Western Electric rule
+    violations = series_points[rules].any(axis=1)
+    fig.add_trace(go.Scatter(x=lots[violations], y=series_points['xbar'][violations], mode='markers', name='Rule Violation',
+                             marker=dict(color='red', size=10, symbol='x')))
+    for name, dash in [('UCL', 'dash'), ('CL', 'solid'), ('LCL', 'dash')]:
+        fig.add_hline(y=series_limits[name], line_dash=dash, line_color='gray', annotation_text=name)
+    fig.update_layout(title=f'{series_limits["Chart"]} Control Chart for Attribute Number: {attribute}',
+                      xaxis_title='Lot Number', yaxis_title='Attribute Value', xaxis_tickangle=-90)
+    fig.update_xaxes(type='category')
+    return fig
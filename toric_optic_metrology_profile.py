@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+import pandas as pd
+
+
+# number of stages being profiled in the process, tracemalloc only runs while it is above zero
+_traced_stages = 0
+_started_tracing = False
+_traced_stages_lock = threading.Lock()
+
+
+# function to start recording the stages of a rerun, returning the profile its stages are added to or None when disabled
+# stages are only timed unless trace_memory is set, since tracemalloc slows down every allocation of the process
+# NOTE: tracemalloc is process-wide, so sessions tracing memory at the same time share (and inflate) each other's peaks,
+# slow each other down, and memory allocated outside Python and numpy (such as by pyarrow) is not traced
+def start_profile(enabled, trace_memory=False):
+    return {'trace_memory': trace_memory, 'stages': []} if enabled else None
+
+
+# function to trace memory allocations while a stage is profiled, stopping when no stage of any session is profiled
+@contextmanager
+def _traced():
+    global _traced_stages, _started_tracing
+    with _traced_stages_lock:
+        if _traced_stages == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _traced_stages += 1
+    try:
+        yield
+    finally:
+        with _traced_stages_lock:
+            _traced_stages -= 1
+            # leave tracing that was started outside the app (such as by python -X tracemalloc) running
+            if _traced_stages == 0 and _started_tracing:
+                tracemalloc.stop()
+                _started_tracing = False
+
+
+# function to record the wall time, rows and (when traced) peak memory of a stage, doing nothing when profile is None
+# the yielded record takes the number of rows once the stage knows it, e.g. record['rows'] = len(df)
+@contextmanager
+def stage(profile, name, rows=None):
+    record = {'stage': name, 'rows': rows}
+    if profile is None:
+        yield record
+        return
+    with _traced() if profile['trace_memory'] else nullcontext():
+        if profile['trace_memory']:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            if profile['trace_memory']:
+                record['peak_mb'] = (tracemalloc.get_traced_memory()[1] - start_memory) / 2 ** 20
+            profile['stages'].append(record)
+
+
+# function to turn the recorded stages of a rerun into a table, with a total row
+def profile_table(profile):
+    columns = ['stage', 'seconds', 'rows'] + (['peak_mb'] if profile['trace_memory'] else [])
+    df_profile = pd.DataFrame(profile['stages'], columns=columns).set_index('stage')
+    total = pd.DataFrame({'seconds': [df_profile['seconds'].sum()], 'rows': [pd.NA]}, index=['Total'])
+    if profile['trace_memory']:
+        total['peak_mb'] = df_profile['peak_mb'].max()
+    df_profile = pd.concat([df_profile, total]).astype({'rows': 'Int64'})
+    return df_profile.rename(columns={'seconds': 'Seconds', 'rows': 'Rows', 'peak_mb': 'Peak Memory (MB)'})
+
+
+# function to append the recorded stages of a rerun to a JSON lines log, one line per rerun
+def write_profile_log(path, profile, **context):
+    record = {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'pid': os.getpid(), **context,
+              'trace_memory': profile['trace_memory'], 'stages': profile['stages']}
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
@@ -0,0 +1,120 @@
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from toric_optic_metrology_data import build_index, cell_stats, combine_stats, derive_attributes, load_rules, read_path, round_float32
+from toric_optic_metrology_plots import MAX_POINTS, attribute_figure, attribute_groups, downsample_points, std_figure
+from toric_optic_metrology_spc import build_spc, load_spec_limits, part_limits
+
+# default config file of the derived attribute rules
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'derived_attributes.json')
+
+# default spec limits CSV used for the process capability
+SPEC_LIMITS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spec_limits.csv')
+
+
+# function to turn a Part_Number or Attribute_Number into a safe file name
+def safe_name(name):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(name))
+
+
+# function to write a table as CSV or Excel
+def write_table(df, path, table_format):
+    if table_format == 'excel':
+        df.to_excel(path + '.xlsx')
+    else:
+        df.to_csv(path + '.csv')
+
+
+# function to write the summary and control limit tables and figures of one Part_Number to its own output directory
+def report_part(part_number, df_part, part_cells, df_limits, output_dir, table_format, plots, max_points):
+    part_dir = os.path.join(output_dir, safe_name(part_number))
+    os.makedirs(part_dir, exist_ok=True)
+
+    # write the summary statistics of all lot numbers
+    df_summary = combine_stats(part_cells)
+    write_table(df_summary, os.path.join(part_dir, 'summary'), table_format)
+
+    # write the control limits, capability and rule violations of every attribute number
+    write_table(df_limits, os.path.join(part_dir, 'spc'), table_format)
+
+    # write the plot of the standard deviation of each attribute number
+    fig = std_figure(df_summary, f'Standard Deviation for All Attribute Numbers in All of Lot Numbers: {part_number}')
+    fig.write_html(os.path.join(part_dir, 'standard_deviation.html'), include_plotlyjs='cdn')
+
+    # write the plot of every attribute number
+    if plots:
+        plot_dir = os.path.join(part_dir, 'attributes')
+        os.makedirs(plot_dir, exist_ok=True)
+        for i, rows in attribute_groups(df_part).items():
+            fig = attribute_figure(downsample_points(df_part.iloc[rows], max_points), i)
+            fig.write_html(os.path.join(plot_dir, safe_name(i) + '.html'), include_plotlyjs='cdn')
+
+    return part_number, len(df_part), len(df_summary)
+
+
+# function to parse the command line arguments
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Write the summary statistics and plots of every Part_Number without the Streamlit app.')
+    parser.add_argument('input', nargs='+', help='Excel or CSV file(s) loaded together as one dataset, or a dataset directory of the columnar store')
+    parser.add_argument('-s', '--sheets', nargs='+', help='Excel sheet(s) to read from every workbook (default: all sheets with the dataset columns)')
+    parser.add_argument('-o', '--output-dir', default='reports', help='directory the reports are written to (default: reports)')
+    parser.add_argument('-p', '--parts', nargs='+', help='Part_Number(s) to report (default: all parts)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes parsing sheets and reporting parts (default: all cores)')
+    parser.add_argument('--format', choices=['csv', 'excel'], default='csv', help='format of the summary tables (default: csv)')
+    parser.add_argument('--no-plots', action='store_true', help='skip the per-attribute plots')
+    parser.add_argument('--max-points', type=int, default=MAX_POINTS,
+                        help=f'point budget per attribute plot, 0 keeps every point (default: {MAX_POINTS})')
+    parser.add_argument('--rules', default=RULES_FILE, help='config file of the derived attribute rules')
+    parser.add_argument('--spec-limits', default=SPEC_LIMITS_FILE, help='spec limits CSV (Part_Number, Attribute_Number, LSL, USL)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+
+    # load, derive, index and aggregate the dataset once, the same way the app does
+    sheets = {os.path.basename(path): args.sheets for path in args.input if path.endswith('.xlsx')} if args.sheets else None
+    df = derive_attributes(read_path(*args.input, sheets=sheets, workers=args.workers), load_rules(args.rules))
+    index = build_index(df)
+    cells = cell_stats(df)
+
+    parts = args.parts or index['parts']
+    missing = [part for part in parts if part not in index['part_rows']]
+    if missing:
+        print(f'Unknown Part_Number(s): {", ".join(missing)}', file=sys.stderr)
+        return 2
+    print(f'Loaded {len(df)} rows in {time.perf_counter() - start:.1f}s, reporting {len(parts)} part(s)')
+
+    # compute the control limits of every attribute series and list the series with rule violations
+    _, limits, _ = build_spc(cells, load_spec_limits(args.spec_limits))
+    os.makedirs(args.output_dir, exist_ok=True)
+    write_table(round_float32(limits[limits['Violations'] > 0]), os.path.join(args.output_dir, 'spc_violations'), args.format)
+
+    # report every part in a process pool
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(report_part, part, df.iloc[index['part_rows'][part]],
+                                   cells.xs(part, level='Part_Number', drop_level=False),
+                                   part_limits(limits, part), args.output_dir,
+                                   args.format, not args.no_plots, args.max_points or None): part
+                   for part in parts}
+        for future in as_completed(futures):
+            try:
+                part, rows, attributes = future.result()
+                print(f'{part}: {rows} rows, {attributes} attributes')
+            except Exception as e:
+                failed.append(futures[future])
+                print(f'{futures[future]}: failed: {e}', file=sys.stderr)
+
+    print(f'Wrote reports to {args.output_dir} in {time.perf_counter() - start:.1f}s')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from toric_optic_metrology_data import custom_sort, round_float32
+
+# keys of an attribute series, whose points are the lots of the series in Lot_Number order
+SERIES_KEYS = ['Part_Number', 'Attribute_Number']
+
+# Western Electric rules as (name, window, count, zone): a point violates a rule when at least count of the last
+# window points (itself included) lie beyond zone sigma on the same side of the center line
+WE_RULES = [
+    ('Rule 1', 1, 1, 3),  # one point beyond 3 sigma
+    ('Rule 2', 3, 2, 2),  # two of three points beyond 2 sigma
+    ('Rule 3', 5, 4, 1),  # four of five points beyond 1 sigma
+    ('Rule 4', 8, 8, 0),  # eight points in a row on one side of the center line
+]
+
+# number of trailing lots of each series kept to evaluate the rules of appended lots
+TAIL_LOTS = max(window for _, window, _, _ in WE_RULES) - 1
+
+# d2 and d3 control chart constants for subgroup sizes 2 to 25
+D2 = np.array([1.128, 1.693, 2.059, 2.326, 2.534, 2.704, 2.847, 2.970, 3.078, 3.173, 3.258, 3.336,
+               3.407, 3.472, 3.532, 3.588, 3.640, 3.689, 3.735, 3.778, 3.819, 3.858, 3.895, 3.931])
+D3 = np.array([0.853, 0.888, 0.880, 0.864, 0.848, 0.833, 0.820, 0.808, 0.797, 0.787, 0.778, 0.770,
+               0.763, 0.756, 0.750, 0.744, 0.739, 0.734, 0.729, 0.724, 0.720, 0.716, 0.712, 0.708])
+
+
+# function to read the spec limits CSV (Part_Number, Attribute_Number, LSL, USL), missing limits are left empty
+def load_spec_limits(path):
+    if not path or not os.path.isfile(path):
+        return pd.DataFrame(columns=SERIES_KEYS + ['LSL', 'USL'])
+    specs = pd.read_csv(path, dtype={key: str for key in SERIES_KEYS})
+    return specs[SERIES_KEYS + ['LSL', 'USL']]
+
+
+# function to turn cell aggregates into the points of every series: one (n, X-bar, R) subgroup per lot
+# seq numbers the lots of each series in custom_sort order starting at offset (the number of lots already seen)
+def series_points(cells, offset=None):
+    points = cells[cells['count'] > 0].reset_index()
+    for key in SERIES_KEYS + ['Lot_Number']:
+        points[key] = points[key].astype(str)
+    lot_order = {lot: i for i, lot in enumerate(sorted(points['Lot_Number'].unique(), key=custom_sort))}
+    points['order'] = points['Lot_Number'].map(lot_order)
+    points = points.sort_values(SERIES_KEYS + ['order'], kind='stable', ignore_index=True)
+    points['seq'] = points.groupby(SERIES_KEYS, sort=False).cumcount()
+    if offset is not None:
+        points = points.merge(offset.rename('offset'), left_on=SERIES_KEYS, right_index=True, how='left')
+        points['seq'] += points.pop('offset').fillna(0).astype(int)
+    points['r'] = points['max'] - points['min']
+    return points.rename(columns={'count': 'n', 'mean': 'xbar'})[SERIES_KEYS + ['seq', 'Lot_Number', 'n', 'xbar', 'r']]
+
+
+# function to accumulate the sums of every series that its control limits are computed from
+def accumulate(points):
+    grouped = points.groupby(SERIES_KEYS, sort=False)
+    moving_range = grouped['xbar'].diff().abs()
+    series = pd.DataFrame({
+        'lots': grouped.size(),
+        'sum_n': grouped['n'].sum(),
+        'sum_xbar': grouped['xbar'].sum(),
+        'sum_r': grouped['r'].sum(),
+        'sum_mr': moving_range.groupby([points[key] for key in SERIES_KEYS], sort=False).sum(),
+        'last_xbar': grouped['xbar'].last(),
+    })
+    return series
+
+
+# function to compute the control limits and capability of every series from its accumulated sums
+# series with subgroups of 2 or more serials use an X-bar/R chart, single-serial lots use an individuals chart
+def spc_limits(series, specs=None):
+    lots = series['lots']
+    n_bar = series['sum_n'] / lots
+    subgroup = np.clip(np.rint(n_bar), 2, 25).astype(int)
+    d2, d3 = D2[subgroup - 2], D3[subgroup - 2]
+    xbar_chart = n_bar >= 2
+
+    center = series['sum_xbar'] / lots
+    r_bar = series['sum_r'] / lots
+    mr_bar = (series['sum_mr'] / (lots - 1)).where(lots > 1)
+    # sigma of the individual values and of the plotted points
+    sigma = (r_bar / d2).where(xbar_chart, mr_bar / D2[0])
+    sigma_point = (sigma / np.sqrt(subgroup)).where(xbar_chart, sigma)
+
+    limits = pd.DataFrame({
+        'Chart': np.where(xbar_chart, 'X-bar/R', 'Individuals'),
+        'Lots': lots,
+        'Mean Subgroup Size': n_bar,
+        'CL': center,
+        'UCL': center + 3 * sigma_point,
+        'LCL': center - 3 * sigma_point,
+        'R-bar': r_bar.where(xbar_chart, mr_bar),
+        'UCL R': (r_bar * (1 + 3 * d3 / d2)).where(xbar_chart, mr_bar * (1 + 3 * D3[0] / D2[0])),
+        'LCL R': (r_bar * np.maximum(0, 1 - 3 * d3 / d2)).where(xbar_chart, 0.0),
+        'Sigma': sigma,
+        'Sigma Point': sigma_point,
+    }, index=series.index)
+
+    # capability against the spec limits of the series, where they are known
+    if specs is not None and len(specs):
+        limits = limits.join(specs.set_index(SERIES_KEYS)[['LSL', 'USL']])
+    else:
+        limits['LSL'] = np.nan
+        limits['USL'] = np.nan
+    limits['Cp'] = (limits['USL'] - limits['LSL']) / (6 * sigma)
+    limits['Cpk'] = np.fmin((limits['USL'] - center) / (3 * sigma), (center - limits['LSL']) / (3 * sigma))
+    return limits
+
+
+# function to count the points beyond a zone in the trailing window of every point, within its own series
+# position is the index of each point within its series, so windows never reach into the previous series
+def rolling_count(beyond, window, position):
+    cumulative = np.concatenate([[0], np.cumsum(beyond)])
+    end = np.arange(1, len(beyond) + 1)
+    start = end - np.minimum(window, position + 1)
+    return cumulative[end] - cumulative[start]
+
+
+# function to flag the Western Electric rule violations of points sorted by series and seq
+def rule_flags(points, limits):
+    sides = points.merge(limits[['CL', 'Sigma Point']], left_on=SERIES_KEYS, right_index=True, how='left')
+    z = ((sides['xbar'] - sides['CL']) / sides['Sigma Point']).to_numpy()
+    position = points.groupby(SERIES_KEYS, sort=False).cumcount().to_numpy()
+    flags = pd.DataFrame({'z': z}, index=points.index)
+    for name, window, count, zone in WE_RULES:
+        upper = rolling_count(z > zone, window, position) >= count
+        lower = rolling_count(z < -zone, window, position) >= count
+        flags[name] = upper | lower
+    return flags
+
+
+# function to build the SPC state of a dataset from its cell aggregates
+# returns the state (accumulated sums and trailing lots of every series), the control limits and the flagged points
+def build_spc(cells, specs=None):
+    points = series_points(cells)
+    series = accumulate(points)
+    limits = spc_limits(series, specs)
+    points = points.join(rule_flags(points, limits))
+    tail = points.groupby(SERIES_KEYS, sort=False).tail(TAIL_LOTS)[SERIES_KEYS + ['seq', 'Lot_Number', 'n', 'xbar', 'r']]
+    state = {'series': series, 'tail': tail.reset_index(drop=True)}
+    return state, summarize_violations(limits, points), points
+
+
+# function to append the cell aggregates of new lots to an SPC state without recomputing the history
+# the new points are checked against the limits before the update and only the trailing lots of each series are reread
+def update_spc(state, new_cells, specs=None):
+    series = state['series']
+    new_points = series_points(new_cells, offset=series['lots'])
+
+    # flag the new points against the current limits, using the trailing lots to complete the rule windows
+    limits = spc_limits(series, specs)
+    window = pd.concat([state['tail'], new_points], ignore_index=True)
+    window = window.sort_values(SERIES_KEYS + ['seq'], kind='stable', ignore_index=True)
+    new_series = new_points.drop_duplicates(SERIES_KEYS).set_index(SERIES_KEYS).index.difference(series.index)
+    if len(new_series):
+        # series seen for the first time take their limits from their own new lots
+        first_points = new_points.set_index(SERIES_KEYS).loc[new_series].reset_index()
+        limits = pd.concat([limits, spc_limits(accumulate(first_points), specs)])
+    window = window.join(rule_flags(window, limits))
+    is_new = (window[SERIES_KEYS + ['seq']].merge(new_points[SERIES_KEYS + ['seq']], how='left', indicator=True)['_merge'] == 'both').to_numpy()
+    flagged = window[is_new].reset_index(drop=True)
+
+    # update the accumulated sums, including the moving range from the last lot already seen
+    added = accumulate(new_points)
+    last_xbar = series['last_xbar'].reindex(added.index)
+    first_xbar = new_points.groupby(SERIES_KEYS, sort=False)['xbar'].first()
+    added['sum_mr'] += (first_xbar - last_xbar).abs().fillna(0)
+    merged = series.reindex(series.index.union(added.index))
+    for col in ['lots', 'sum_n', 'sum_xbar', 'sum_r', 'sum_mr']:
+        merged[col] = merged[col].fillna(0).add(added[col].reindex(merged.index).fillna(0))
+    merged['lots'] = merged['lots'].astype(int)
+    merged['last_xbar'] = added['last_xbar'].reindex(merged.index).fillna(merged['last_xbar'])
+
+    tail = window.groupby(SERIES_KEYS, sort=False).tail(TAIL_LOTS)[SERIES_KEYS + ['seq', 'Lot_Number', 'n', 'xbar', 'r']]
+    new_state = {'series': merged, 'tail': tail.reset_index(drop=True)}
+    return new_state, flagged
+
+
+# function to get the control limits of one Part_Number indexed by Attribute_Number, empty for a part without any series
+# the limits are rounded to float32 precision for display and export
+def part_limits(limits, part_number):
+    if part_number not in limits.index.get_level_values('Part_Number'):
+        return limits.iloc[:0].droplevel('Part_Number')
+    return round_float32(limits.xs(part_number, level='Part_Number'))
+
+
+# function to add the number of rule violations of every series to its control limits
+def summarize_violations(limits, points):
+    rules = [name for name, _, _, _ in WE_RULES]
+    violations = points.groupby(SERIES_KEYS, sort=False)[rules].sum()
+    limits = limits.join(violations.rename(columns=lambda name: name + ' Violations'))
+    limits['Violations'] = violations.sum(axis=1).reindex(limits.index)
+    return limits
+
+
+# function to extend the SPC of a dataset (state, limits and flagged points) with the cell aggregates of appended rows
+# appended lots that follow the lots of their series update the state with update_spc, and the series they touch are
+# flagged again against their updated limits (one point per lot), so the result matches build_spc on all cells;
+# anything else rebuilds from all cells
+def extend_spc(spc, cells, new_cells, specs=None):
+    state, _, points = spc
+    new_points = series_points(new_cells)
+    last_lots = state['tail'].groupby(SERIES_KEYS, sort=False)['Lot_Number'].last()
+    first_lots = new_points.groupby(SERIES_KEYS, sort=False)['Lot_Number'].first()
+    follows = [custom_sort(first) > custom_sort(last_lots[key]) for key, first in first_lots.items() if key in last_lots.index]
+    if not all(follows):
+        return build_spc(cells, specs)
+    new_state, added = update_spc(state, new_cells, specs)
+    limits = spc_limits(new_state['series'], specs)
+
+    # flag every point of the touched series against the updated limits, keeping the flags of the other series
+    columns = SERIES_KEYS + ['seq', 'Lot_Number', 'n', 'xbar', 'r']
+    touched = pd.MultiIndex.from_frame(points[SERIES_KEYS]).isin(pd.MultiIndex.from_frame(added[SERIES_KEYS].drop_duplicates()))
+    series = pd.concat([points.loc[touched, columns], added[columns]]).sort_values(SERIES_KEYS + ['seq'], ignore_index=True)
+    series = series.join(rule_flags(series, limits))
+    points = pd.concat([points[~touched], series], ignore_index=True)
+    return new_state, summarize_violations(limits, points), points